@@ -0,0 +1,12 @@
+from backend.modules.data_manager import DataManager
+
+# One DataManager for the whole process, so every router sees the same data
+data_manager = DataManager()
+
+def get_data_manager():
+    """
+    FastAPI dependency returning the shared DataManager.
+    Files edited outside this process are re-read; unchanged files are not.
+    """
+    data_manager.refresh()
+    return data_manager
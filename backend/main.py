@@ -1,6 +1,8 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from backend.modules.data_manager import DataManager
+from fastapi.responses import PlainTextResponse
+from backend.modules import metrics
 
 app = FastAPI(
     title="Network Automation API",
@@ -21,11 +23,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Job ID of /batch/execute, used by the frontend to download the archive
+    expose_headers=["X-Job-Id"],
 )
 
-# Initialize Data Manager
-data_manager = DataManager()
-
 @app.get("/")
 async def root():
     return {"message": "Network Automation API is running", "status": "ok"}
@@ -34,6 +35,27 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of the backend metrics"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by router (its tag) rather than raw path to keep cardinality bounded
+        route = request.scope.get("route")
+        tags = getattr(route, "tags", None)
+        router = tags[0] if tags else ("root" if route else "unmatched")
+        metrics.http_requests_total.inc(router=router, method=request.method, status=status)
+        metrics.http_request_seconds.observe(time.monotonic() - start, router=router)
+
 # Import and Include Routers
 from backend.routers import inventory, jumphosts, credentials, batch, gateway
 app.include_router(inventory.router)
@@ -41,3 +63,17 @@ app.include_router(jumphosts.router)
 app.include_router(credentials.router)
 app.include_router(batch.router)
 app.include_router(gateway.router)
+
+@app.on_event("startup")
+async def startup_event():
+    # Periodic eviction of stored batch outputs and leftover download files
+    batch.retention_engine.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    from backend.modules.batch_executor import batch_executor
+    from backend.dependencies import data_manager
+    batch.retention_engine.stop()
+    batch_executor.shutdown()
+    # Write inventory changes still inside the coalescing window
+    data_manager.flush()
@@ -0,0 +1,485 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from backend.modules.device_manager import DeviceConnection, StageTimer, combine_outputs, detect_device_type
+from backend.modules.result_store import result_store as default_result_store
+from backend.modules.retry_policy import RetryBudget, RetryState, classify_error
+from backend.modules.session_pool import session_pool as default_session_pool
+from backend.modules.ssh_manager import gateway_registry as default_gateway_registry
+from backend.modules import metrics
+
+# Number of devices handled concurrently across all batches in this process.
+DEFAULT_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "20"))
+
+STOP_MESSAGES = {
+    "timeout": "Batch deadline exceeded before the device finished",
+    "cancelled": "Batch cancelled before the device finished",
+}
+
+class ExecutionContext:
+    """
+    Per-batch limits, retry budget and stop state shared by the workers of one batch.
+    stop() aborts every in-flight device connection so that blocked workers
+    return right away; devices that have not started are skipped.
+    """
+    def __init__(self, connect_timeout=None, command_timeout=None, deadline=None, retry_budget=None):
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.deadline_at = time.monotonic() + deadline if deadline else None
+        self.retry_budget = RetryBudget() if retry_budget is None else RetryBudget(retry_budget)
+        self.reason = None
+        self.active = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self._timer = None
+        if deadline:
+            self._timer = threading.Timer(deadline, self.stop, args=("timeout",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def remaining(self):
+        """Seconds left before the batch deadline, or None without a deadline."""
+        if self.deadline_at is None:
+            return None
+        return max(0.0, self.deadline_at - time.monotonic())
+
+    def connect_budget(self):
+        """Time a device may spend connecting: the connect timeout, capped by the deadline."""
+        limits = [t for t in (self.connect_timeout, self.remaining()) if t is not None]
+        return min(limits) if limits else None
+
+    def pause(self, delay):
+        """
+        Waits out a retry backoff. Returns True (give up) if the batch stops
+        meanwhile or the deadline would pass before the retry.
+        """
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            return True
+        return self.stopped.wait(delay)
+
+    def register(self, device_name, abort):
+        """Tracks how to abort a device's in-flight connection."""
+        with self.lock:
+            stopped = self.reason is not None
+            if not stopped:
+                self.active[device_name] = abort
+        if stopped:
+            abort()
+
+    def unregister(self, device_name):
+        with self.lock:
+            self.active.pop(device_name, None)
+
+    def stop(self, reason):
+        """Stops the batch ("timeout" or "cancelled") and aborts in-flight devices."""
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            aborts = list(self.active.values())
+        self.stopped.set()
+        for abort in aborts:
+            try:
+                abort()
+            except Exception:
+                pass
+
+    def finish(self):
+        """Releases the deadline timer once every device is done."""
+        if self._timer:
+            self._timer.cancel()
+
+class BatchExecutor:
+    """
+    Runs blocking Netmiko work on a bounded thread pool so that batch
+    execution never blocks the FastAPI event loop.
+    """
+    def __init__(self, max_workers=None, session_pool=None, gateway_registry=None, result_store=None):
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.session_pool = session_pool or default_session_pool
+        self.gateway_registry = gateway_registry or default_gateway_registry
+        self.result_store = result_store or default_result_store
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch")
+
+    def resolve_gateway(self, device_data, gateway_session, data_manager):
+        """
+        Returns (session, chain) for the gateway a device must go through: the
+        shared session of its own jump host chain, or the manually connected
+        gateway (chain None) for devices without a jumphost_profile.
+        A returned chain holds a registry reference that must be released.
+        """
+        if device_data.get('jumphost_profile'):
+            chain = (device_data['jumphost_profile'], device_data.get('jumphost2_profile'))
+            return self.gateway_registry.acquire(data_manager, *chain), chain
+        if gateway_session and gateway_session.is_active():
+            return gateway_session, None
+        raise Exception("Gateway session not connected. Please connect to gateway first.")
+
+    def run_device(self, device_name, commands, gateway_session, data_manager, on_state=None, context=None, job_id=None):
+        """
+        Connects to a single device through its gateway and runs the commands
+        in order over one session.
+        Blocking - always called from a worker thread.
+
+        Args:
+            commands (list): Ordered list of commands to run.
+            gateway_session (GatewaySession): Used for devices without a jump host profile.
+            on_state (callable): Optional callback, called with "connecting" and
+                "running" as the device moves through its execution stages.
+            context (ExecutionContext): Timeouts and stop state of the batch.
+            job_id (str): If given, the outputs are kept in the result store under this ID.
+
+        Returns:
+            dict: {"device", "status", "output", "commands", "timings", "attempts"} as returned
+                by /batch/execute, where "commands" holds the per-command output, status and
+                duration and "timings" the seconds spent in each stage (gateway, channel_open,
+                ssh_connect, session_prep, commands, total). Connection stages are absent
+                when a pooled session was reused. Devices with status "error" also carry
+                "error_class" (auth, unknown_host, throttled, timeout, connection, error).
+        """
+        context = context or ExecutionContext()
+        if context.reason:
+            # Deadline passed or batch cancelled while the device was queued
+            result = {"device": device_name, "status": context.reason, "output": STOP_MESSAGES[context.reason]}
+        else:
+            result = self._execute_device(device_name, commands, gateway_session, data_manager, on_state, context)
+        self._observe(result)
+        if job_id:
+            try:
+                self.result_store.put_result(job_id, result)
+            except Exception as e:
+                print(f"Failed to store results of {device_name}: {e}")
+        return result
+
+    def detect_device(self, device_name, gateway_session, data_manager, on_state=None, context=None):
+        """
+        Probes a single device through its gateway for its Netmiko device_type and
+        saves a detected type to the inventory with a detection timestamp.
+        Blocking - always called from a worker thread.
+
+        Returns:
+            dict: {"device", "status", "output", "device_type", "previous_device_type",
+                "timings", "attempts"}; status is "error" when no platform matched.
+        """
+        context = context or ExecutionContext()
+        if context.reason:
+            result = {"device": device_name, "status": context.reason, "output": STOP_MESSAGES[context.reason]}
+        else:
+            result = self._detect_device(device_name, gateway_session, data_manager, on_state, context)
+        self._observe(result)
+        return result
+
+    def _observe(self, result):
+        metrics.device_executions_total.inc(status=result["status"])
+        for stage, duration in result.get("timings", {}).items():
+            metrics.device_execution_seconds.observe(duration, stage=stage)
+
+    def _detect_device(self, device_name, gateway_session, data_manager, on_state, context):
+        device_data = data_manager.get_device(device_name)
+        if device_data is None:
+            return {
+                "device": device_name,
+                "status": "error",
+                "output": f"Device {device_name} not found in inventory"
+            }
+
+        cred_name = device_data.get("credential_name")
+        cred = data_manager.credentials.get(cred_name) if cred_name else None
+        if not cred:
+            return {
+                "device": device_name,
+                "status": "error",
+                "output": f"Credentials '{cred_name}' not found"
+            }
+
+        timer = StageTimer()
+
+        def probe():
+            budget = context.connect_budget()
+            with timer.stage("channel_open"):
+                sock = device_gateway.open_channel(
+                    device_data['host'], device_data['port'], timeout=budget, stop=context.stopped
+                )
+            context.register(device_name, sock.close)
+            try:
+                if on_state:
+                    on_state("running")
+                with timer.stage("detect"):
+                    return detect_device_type(
+                        device_data['host'],
+                        cred['username'],
+                        cred['password'],
+                        port=device_data['port'],
+                        secret=cred.get('secret', ''),
+                        sock=sock,
+                        timeout=budget
+                    )
+            finally:
+                sock.close()
+
+        chain = None
+        retry = RetryState(context.retry_budget, wait=context.pause)
+        start = time.monotonic()
+        previous_type = device_data.get('device_type')
+        try:
+            if on_state:
+                on_state("connecting")
+            with timer.stage("gateway"):
+                device_gateway, chain = self.resolve_gateway(device_data, gateway_session, data_manager)
+            detected = retry.run(probe)
+
+            if context.reason:
+                result = {"device": device_name, "status": context.reason, "output": STOP_MESSAGES[context.reason]}
+            elif detected:
+                data_manager.save_device(
+                    device_name,
+                    detected,
+                    device_data['host'],
+                    device_data['port'],
+                    device_data.get('credential_name'),
+                    device_data.get('jumphost_profile'),
+                    device_data.get('jumphost2_profile'),
+                    device_data.get('tags'),
+                    device_type_detected_at=datetime.now().isoformat()
+                )
+                changed = "" if detected == previous_type else f" (was {previous_type})"
+                result = {"device": device_name, "status": "success", "output": f"Detected {detected}{changed}"}
+            else:
+                result = {"device": device_name, "status": "error", "output": "No matching Netmiko device type"}
+        except Exception as e:
+            if context.reason:
+                result = {"device": device_name, "status": context.reason, "output": STOP_MESSAGES[context.reason]}
+            else:
+                result = {
+                    "device": device_name,
+                    "status": "error",
+                    "output": f"Detection failed: {str(e)}",
+                    "error_class": classify_error(e)
+                }
+            detected = None
+        finally:
+            context.unregister(device_name)
+            if chain:
+                self.gateway_registry.release(*chain)
+
+        timer.timings["total"] = round(time.monotonic() - start, 4)
+        result.update({
+            "device_type": detected,
+            "previous_device_type": previous_type,
+            "timings": timer.timings,
+            "attempts": max(retry.attempts, 1)
+        })
+        return result
+
+    def _execute_device(self, device_name, commands, gateway_session, data_manager, on_state, context):
+        device_data = data_manager.get_device(device_name)
+        if device_data is None:
+            return {
+                "device": device_name,
+                "status": "error",
+                "output": f"Device {device_name} not found in inventory"
+            }
+
+        # Resolve credentials
+        cred_name = device_data.get("credential_name")
+        cred = data_manager.credentials.get(cred_name) if cred_name else None
+        if not cred:
+            return {
+                "device": device_name,
+                "status": "error",
+                "output": f"Credentials '{cred_name}' not found"
+            }
+
+        timer = StageTimer()
+        connect_timed_out = threading.Event()
+
+        def connect():
+            connect_timed_out.clear()
+            budget = context.connect_budget()
+            # Open a channel through the gateway to the device
+            opened_at = time.monotonic()
+            with timer.stage("channel_open"):
+                try:
+                    sock = device_gateway.open_channel(
+                        device_data['host'], device_data['port'], timeout=budget, stop=context.stopped
+                    )
+                except Exception:
+                    if budget and time.monotonic() - opened_at >= budget:
+                        connect_timed_out.set()
+                    raise
+            context.register(device_name, sock.close)
+
+            # Netmiko's own timeouts do not cover every step; close the channel if connecting overruns
+            watchdog = None
+            if budget:
+                def expire():
+                    connect_timed_out.set()
+                    sock.close()
+                watchdog = threading.Timer(budget, expire)
+                watchdog.daemon = True
+                watchdog.start()
+
+            device_connection = DeviceConnection()
+            try:
+                device_connection.connect(
+                    device_type=device_data['device_type'],
+                    host=device_data['host'],  # This is used for reference only when sock is provided
+                    port=device_data['port'],
+                    username=cred['username'],
+                    password=cred['password'],
+                    secret=cred.get('secret', ''),
+                    sock=sock,  # Pass the gateway channel
+                    timeout=budget,
+                    profile=data_manager.get_session_profile(device_name)
+                )
+            except Exception:
+                sock.close()
+                raise
+            finally:
+                if watchdog:
+                    watchdog.cancel()
+                timer.timings.update(device_connection.timings)
+            if device_connection.learned_profile:
+                # Later logins replay this instead of rediscovering the session
+                data_manager.save_session_profile(device_name, device_connection.learned_profile)
+            return device_connection
+
+        device_connection = None
+        chain = None
+        # Transient connect failures are retried with backoff; commands are never re-sent
+        retry = RetryState(context.retry_budget, wait=context.pause)
+        start = time.monotonic()
+        try:
+            if on_state:
+                on_state("connecting")
+            with timer.stage("gateway"):
+                device_gateway, chain = self.resolve_gateway(device_data, gateway_session, data_manager)
+
+            # Pooled sessions are only reused if they were opened with the same parameters
+            signature = (
+                device_data['host'],
+                device_data['port'],
+                device_data['device_type'],
+                cred['username'],
+                id(device_gateway)
+            )
+            device_connection = retry.run(lambda: self.session_pool.acquire(device_name, signature, connect))
+            context.register(device_name, device_connection.abort)
+
+            if on_state:
+                on_state("running")
+            with timer.stage("commands"):
+                command_results = device_connection.send_commands(commands, read_timeout=context.command_timeout)
+
+            if context.reason:
+                status = context.reason
+            elif all(r['status'] == "success" for r in command_results):
+                status = "success"
+            elif any(r['status'] == "timeout" for r in command_results):
+                status = "timeout"
+            else:
+                status = "error"
+
+            if status == "success":
+                self.session_pool.release(device_name, signature, device_connection)
+            else:
+                self.session_pool.discard(device_connection)
+            result = {
+                "device": device_name,
+                "status": status,
+                "output": combine_outputs(command_results),
+                "commands": command_results
+            }
+        except Exception as e:
+            if device_connection:
+                self.session_pool.discard(device_connection)
+            if context.reason:
+                result = {"device": device_name, "status": context.reason, "output": STOP_MESSAGES[context.reason]}
+            elif connect_timed_out.is_set():
+                result = {"device": device_name, "status": "timeout", "output": "Connection timed out"}
+            else:
+                result = {
+                    "device": device_name,
+                    "status": "error",
+                    "output": f"Connection/execution failed: {str(e)}",
+                    "error_class": classify_error(e)
+                }
+        finally:
+            context.unregister(device_name)
+            if chain:
+                self.gateway_registry.release(*chain)
+
+        timer.timings["total"] = round(time.monotonic() - start, 4)
+        result["timings"] = timer.timings
+        result["attempts"] = max(retry.attempts, 1)
+        return result
+
+    def order_by_chain(self, device_names, data_manager):
+        """
+        Splits devices by jump host chain and interleaves the groups, so every
+        chain of a mixed-site batch starts working in parallel instead of the
+        first site occupying all workers.
+        """
+        groups = {}
+        for name in device_names:
+            device_data = data_manager.get_device(name) or {}
+            chain = (device_data.get('jumphost_profile'), device_data.get('jumphost2_profile'))
+            groups.setdefault(chain, []).append(name)
+        return [
+            name
+            for batch in itertools.zip_longest(*groups.values())
+            for name in batch
+            if name is not None
+        ]
+
+    def submit_batch(self, device_names, commands, gateway_session, data_manager, context, job_id=None):
+        """Schedules every device on the worker pool and returns {device_name: future}."""
+        loop = asyncio.get_running_loop()
+        return {
+            name: loop.run_in_executor(
+                self.pool, self.run_device, name, commands, gateway_session, data_manager, None, context, job_id
+            )
+            for name in self.order_by_chain(device_names, data_manager)
+        }
+
+    async def run_batch(self, device_names, commands, gateway_session, data_manager, context=None, job_id=None):
+        """
+        Executes the commands on all devices concurrently (bounded by max_workers).
+        Results are returned in the same order as device_names.
+        """
+        context = context or ExecutionContext()
+        futures = self.submit_batch(device_names, commands, gateway_session, data_manager, context, job_id)
+        try:
+            return await asyncio.gather(*(futures[name] for name in device_names))
+        finally:
+            context.finish()
+
+    async def iter_batch(self, device_names, commands, gateway_session, data_manager, context=None, job_id=None):
+        """
+        Executes the commands on all devices concurrently and yields each
+        result as soon as its device finishes (completion order).
+        """
+        context = context or ExecutionContext()
+        futures = self.submit_batch(device_names, commands, gateway_session, data_manager, context, job_id)
+        try:
+            for future in asyncio.as_completed(list(futures.values())):
+                yield await future
+        finally:
+            # Client went away: drop devices that have not started and abort running ones
+            if not all(future.done() for future in futures.values()):
+                context.stop("cancelled")
+            for future in futures.values():
+                future.cancel()
+            context.finish()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.session_pool.close_all()
+
+# Process-wide executor shared by all batch endpoints
+batch_executor = BatchExecutor()
@@ -1,13 +1,57 @@
+import atexit
 import json
 import os
+import threading
+import weakref
+from contextlib import contextmanager
+from backend.modules.inventory_store import INVENTORY_BACKEND, INVENTORY_DB_FILE, JsonInventoryStore, SqliteInventoryStore
 
 DATA_DIR = "data"
 CREDENTIALS_FILE = os.path.join(DATA_DIR, "credentials.json")
 INVENTORY_FILE = os.path.join(DATA_DIR, "inventory.json")
+# Learned per-device session profiles (see device_manager.learn_session_profile)
+SESSION_PROFILES_FILE = os.path.join(DATA_DIR, "session_profiles.json")
+# Seconds changes are held back so a burst of edits costs one write per file (0 writes immediately)
+WRITE_DELAY = float(os.environ.get("DATA_WRITE_DELAY", "0.2"))
+
+# Process-wide count of JSON file reads and writes (exported as metrics)
+io_stats = {"read": 0, "write": 0}
+_io_stats_lock = threading.Lock()
+
+def _count_io(operation):
+    with _io_stats_lock:
+        io_stats[operation] += 1
+
+def _file_signature(filepath):
+    """(mtime, size) of a file, used to notice changes made by other processes."""
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Instances with possibly unwritten changes, flushed when the process exits
+_instances = weakref.WeakSet()
+
+@atexit.register
+def _flush_all():
+    for instance in list(_instances):
+        try:
+            instance.flush()
+        except Exception as e:
+            print(f"Failed to write data files on exit: {e}")
 
 class DataManager:
     """
     Manages persistence of credentials and device inventory using JSON files.
+    The inventory goes through a pluggable InventoryStore: inventory.json by
+    default, or a SQLite database with inventory_backend="sqlite".
+    refresh() re-reads only the files that changed on disk since they were last
+    read or written, so one long-lived instance can be shared.
+
+    Writes are atomic (temporary file, then rename) and coalesced: changes made
+    within write_delay seconds are written together, once per file. Call flush()
+    to write pending changes now, or wrap bulk edits in deferred_writes().
     """
     def _ensure_data_dir(self):
         if not os.path.exists(DATA_DIR):
@@ -18,6 +62,9 @@ class DataManager:
         if not os.path.exists(INVENTORY_FILE):
             with open(INVENTORY_FILE, 'w') as f:
                 json.dump({}, f)
+        if not os.path.exists(SESSION_PROFILES_FILE):
+            with open(SESSION_PROFILES_FILE, 'w') as f:
+                json.dump({}, f)
         
         # Jump Host Profiles
         self.jumphosts_file = os.path.join(DATA_DIR, "jumphosts.json")
@@ -25,89 +72,250 @@ class DataManager:
             with open(self.jumphosts_file, 'w') as f:
                 json.dump({}, f)
 
-    def __init__(self):
+    def __init__(self, write_delay=WRITE_DELAY, inventory_backend=INVENTORY_BACKEND):
         self._ensure_data_dir()
+        self.write_delay = write_delay
+        # filepath -> data waiting to be written
+        self.pending = {}
+        self._timer = None
+        self._deferred = 0
+        # filepath -> (mtime, size) when it was last read or written
+        self.file_signatures = {}
         self.credentials = self.load_credentials()
-        self.inventory = self.load_inventory()
+        if inventory_backend == "sqlite":
+            self.inventory_store = SqliteInventoryStore(INVENTORY_DB_FILE, json_file=INVENTORY_FILE)
+        elif inventory_backend == "json":
+            self.inventory_store = JsonInventoryStore(
+                self.load_inventory(), lambda data: self._save_file(INVENTORY_FILE, data)
+            )
+        else:
+            raise Exception(f"Unknown inventory backend '{inventory_backend}' (use json or sqlite)")
         self.jumphosts = self.load_jumphosts()
+        self.session_profiles = self.load_session_profiles()
+        # Session profiles and detected device types are saved from batch worker threads
+        self.lock = threading.RLock()
+        _instances.add(self)
 
-    def load_jumphosts(self):
+    @property
+    def inventory(self):
+        """Read-only {name: device} mapping; change devices through save_device() and friends."""
+        return self.inventory_store.view()
+
+    def _files(self):
+        files = {
+            "credentials": CREDENTIALS_FILE,
+            "jumphosts": self.jumphosts_file,
+            "session_profiles": SESSION_PROFILES_FILE,
+        }
+        if isinstance(self.inventory_store, JsonInventoryStore):
+            files["inventory"] = INVENTORY_FILE
+        return files
+
+    def _load_file(self, filepath):
+        signature = _file_signature(filepath)
         try:
-            with open(self.jumphosts_file, 'r') as f:
-                return json.load(f)
+            _count_io("read")
+            with open(filepath, 'r') as f:
+                data = json.load(f)
         except (json.JSONDecodeError, FileNotFoundError):
-            return {}
+            data = {}
+        self.file_signatures[filepath] = signature
+        return data
+
+    def refresh(self):
+        """
+        Re-reads the data files whose mtime or size changed since this instance
+        last read or wrote them. Returns the names of the reloaded collections.
+        """
+        reloaded = []
+        with self.lock:
+            for attribute, filepath in self._files().items():
+                if filepath in self.pending:
+                    # Our unwritten changes are newer than the file
+                    continue
+                if _file_signature(filepath) != self.file_signatures.get(filepath):
+                    if attribute == "inventory":
+                        self.inventory_store.load(self._load_file(filepath))
+                    else:
+                        setattr(self, attribute, self._load_file(filepath))
+                    reloaded.append(attribute)
+        return reloaded
+
+    def load_jumphosts(self):
+        return self._load_file(self.jumphosts_file)
 
     def save_jumphost(self, name, host, username, password, port=22):
-        self.jumphosts[name] = {
-            "host": host,
-            "username": username,
-            "password": password,
-            "port": port
-        }
-        self._save_file(self.jumphosts_file, self.jumphosts)
+        with self.lock:
+            self.jumphosts[name] = {
+                "host": host,
+                "username": username,
+                "password": password,
+                "port": port
+            }
+            self._save_file(self.jumphosts_file, self.jumphosts)
 
     def delete_jumphost(self, name):
-        if name in self.jumphosts:
-            del self.jumphosts[name]
-            self._save_file(self.jumphosts_file, self.jumphosts)
+        with self.lock:
+            if name in self.jumphosts:
+                del self.jumphosts[name]
+                self._save_file(self.jumphosts_file, self.jumphosts)
 
     def load_credentials(self):
-        try:
-            with open(CREDENTIALS_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
+        return self._load_file(CREDENTIALS_FILE)
 
     def save_credential(self, name, username, password, secret=""):
-        self.credentials[name] = {
-            "username": username,
-            "password": password,
-            "secret": secret
-        }
-        self._save_file(CREDENTIALS_FILE, self.credentials)
+        with self.lock:
+            self.credentials[name] = {
+                "username": username,
+                "password": password,
+                "secret": secret
+            }
+            self._save_file(CREDENTIALS_FILE, self.credentials)
 
     def delete_credential(self, name):
-        if name in self.credentials:
-            del self.credentials[name]
-            self._save_file(CREDENTIALS_FILE, self.credentials)
+        with self.lock:
+            if name in self.credentials:
+                del self.credentials[name]
+                self._save_file(CREDENTIALS_FILE, self.credentials)
 
     def load_inventory(self):
-        try:
-            with open(INVENTORY_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-
-    def save_device(self, name, device_type, host, port, credential_name, jumphost_profile=None, jumphost2_profile=None, tags=None):
-        self.inventory[name] = {
-            "device_type": device_type,
-            "host": host,
-            "port": port,
-            "credential_name": credential_name,
-            "jumphost_profile": jumphost_profile,
-            "jumphost2_profile": jumphost2_profile,
-            "tags": tags if tags else []
-        }
-        self._save_file(INVENTORY_FILE, self.inventory)
+        return self._load_file(INVENTORY_FILE)
+
+    def save_device(self, name, device_type, host, port, credential_name, jumphost_profile=None, jumphost2_profile=None, tags=None, device_type_detected_at=None):
+        """
+        Adds or replaces a device. device_type_detected_at is set when device_type
+        was found by autodetection; it is kept as long as the device type stays the same.
+        """
+        with self.lock:
+            previous = self.inventory_store.get(name)
+            if previous and (previous.get("device_type"), previous.get("host")) != (device_type, host):
+                # A learned session profile only applies to the device it was learned on
+                self.delete_session_profile(name)
+            if device_type_detected_at is None and previous and previous.get("device_type") == device_type:
+                device_type_detected_at = previous.get("device_type_detected_at")
+            device = {
+                "device_type": device_type,
+                "host": host,
+                "port": port,
+                "credential_name": credential_name,
+                "jumphost_profile": jumphost_profile,
+                "jumphost2_profile": jumphost2_profile,
+                "tags": tags if tags else []
+            }
+            if device_type_detected_at:
+                device["device_type_detected_at"] = device_type_detected_at
+            self.inventory_store.put(name, device)
+
+    def save_devices(self, devices):
+        """
+        Adds or replaces many devices ({name: device dict}) in a single store write:
+        one transaction with SQLite, one inventory.json write with JSON.
+        Session profiles and detection timestamps follow the save_device rules.
+        """
+        with self.lock, self.deferred_writes():
+            current = dict(self.inventory_store.items())
+            merged = {}
+            for name, device in devices.items():
+                device = dict(device)
+                previous = current.get(name)
+                if previous and (previous.get("device_type"), previous.get("host")) != (device.get("device_type"), device.get("host")):
+                    self.delete_session_profile(name)
+                if not device.get("device_type_detected_at") and previous and previous.get("device_type") == device.get("device_type"):
+                    if previous.get("device_type_detected_at"):
+                        device["device_type_detected_at"] = previous["device_type_detected_at"]
+                merged[name] = device
+            self.inventory_store.put_many(merged)
 
     def delete_device(self, name):
-        if name in self.inventory:
-            del self.inventory[name]
-            self._save_file(INVENTORY_FILE, self.inventory)
+        with self.lock:
+            if self.inventory_store.get(name) is not None:
+                self.inventory_store.delete(name)
+                self.delete_session_profile(name)
+
+    def load_session_profiles(self):
+        return self._load_file(SESSION_PROFILES_FILE)
+
+    def get_session_profile(self, name):
+        """Returns the learned session profile of a device, or None."""
+        return self.session_profiles.get(name)
+
+    def save_session_profile(self, name, profile):
+        with self.lock:
+            self.session_profiles[name] = profile
+            self._save_file(SESSION_PROFILES_FILE, self.session_profiles)
+
+    def delete_session_profile(self, name):
+        with self.lock:
+            if name in self.session_profiles:
+                del self.session_profiles[name]
+                self._save_file(SESSION_PROFILES_FILE, self.session_profiles)
 
     def _save_file(self, filepath, data):
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=4)
+        """Queues data to be written to filepath once the write window closes."""
+        with self.lock:
+            self.pending[filepath] = data
+            if self._deferred:
+                return
+            if self.write_delay <= 0:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.write_delay, self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_timer(self):
+        with self.lock:
+            self._timer = None
+            if not self._deferred:
+                self.flush()
+
+    def flush(self):
+        """Writes every pending change now."""
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            while self.pending:
+                filepath, data = next(iter(self.pending.items()))
+                self._write_file(filepath, data)
+                del self.pending[filepath]
+
+    @contextmanager
+    def deferred_writes(self):
+        """
+        Holds back writes until the block exits, then writes each changed file
+        once, however long the block takes.
+        """
+        with self.lock:
+            self._deferred += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._deferred -= 1
+                if not self._deferred:
+                    self.flush()
+
+    def _write_file(self, filepath, data):
+        """Writes compact JSON through a temporary file, so a crash never leaves a half-written file."""
+        _count_io("write")
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+        # Our own write must not trigger a reload
+        self.file_signatures[filepath] = _file_signature(filepath)
 
     def get_all_devices(self):
         """Returns the full inventory dictionary."""
-        return self.inventory
+        return dict(self.inventory_store.items())
 
     def get_all_devices_list(self):
         """Returns inventory as a list of dicts for DataFrames."""
         device_list = []
-        for name, data in self.inventory.items():
+        for name, data in self.inventory_store.items():
             item = data.copy()
             item['name'] = name
             # Format tags as string for display
@@ -118,7 +326,44 @@ class DataManager:
 
     def get_device(self, name):
         """Returns configuration for a specific device."""
-        return self.inventory.get(name)
+        return self.inventory_store.get(name)
+
+    def find_devices(self, tag=None, **filters):
+        """
+        Returns the names of the devices with a tag and/or field values
+        (device_type, jumphost_profile, credential_name), using the store's indexes.
+        """
+        return self.inventory_store.find(tag, **filters)
+
+    def query_devices(self, expression):
+        """
+        Returns the names of the devices matching a tag expression, e.g.
+        'core AND (dc1 OR dc2) AND NOT lab', in inventory order.
+        Raises ValueError if the expression is malformed.
+        """
+        return self.inventory_store.query(expression)
+
+    def get_tag_counts(self):
+        """Returns {tag: number of devices} for every tag in use."""
+        return self.inventory_store.tag_counts()
+
+    def get_devices_list(self, names):
+        """Like get_all_devices_list, for the given device names only."""
+        devices = self.inventory_store.get_many(names)
+        device_list = []
+        for name in names:
+            if name not in devices:
+                continue
+            item = devices[name].copy()
+            item['name'] = name
+            tags = item.get('tags', [])
+            item['tags_display'] = ", ".join(tags) if tags else ""
+            device_list.append(item)
+        return device_list
+
+    def iter_devices(self, tag=None, **filters):
+        """Yields (name, device) for the devices matching find_devices(), a chunk at a time."""
+        return self.inventory_store.iter_devices(tag, **filters)
 
     def get_jumphost(self, name):
         """Returns configuration for a specific jump host."""
@@ -133,6 +378,7 @@ class DataManager:
         Replaces the entire inventory with the provided list of dictionaries.
         Used for syncing changes from the UI editor.
         """
+        current = dict(self.inventory_store.items())
         new_inventory = {}
         for item in device_list:
             name = item.get('name')
@@ -156,6 +402,20 @@ class DataManager:
                 "jumphost2_profile": item.get('jumphost2_profile'),
                 "tags": tag_list
             }
+            # Keep the autodetection timestamp unless the type was edited
+            previous = current.get(name) or {}
+            if previous.get('device_type_detected_at') and previous.get('device_type') == new_inventory[name]['device_type']:
+                new_inventory[name]["device_type_detected_at"] = previous['device_type_detected_at']
         
-        self.inventory = new_inventory
-        self._save_file(INVENTORY_FILE, self.inventory)
+        with self.lock, self.deferred_writes():
+            self.inventory_store.replace(new_inventory)
+
+            # Forget session profiles of removed or re-typed devices
+            stale = [
+                name for name, profile in self.session_profiles.items()
+                if name not in new_inventory or new_inventory[name]["device_type"] != profile.get("device_type")
+            ]
+            for name in stale:
+                del self.session_profiles[name]
+            if stale:
+                self._save_file(SESSION_PROFILES_FILE, self.session_profiles)
@@ -0,0 +1,178 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from backend.modules.device_manager import summarize_timings
+from backend.modules import metrics
+from backend.modules.batch_executor import ExecutionContext
+
+# Finished jobs kept in memory for polling before the oldest are dropped.
+MAX_FINISHED_JOBS = int(os.environ.get("BATCH_MAX_FINISHED_JOBS", "100"))
+
+DEVICE_STATES = ("queued", "connecting", "running", "done", "failed", "timeout", "cancelled")
+
+# Final device state for each result status; anything else is "failed"
+RESULT_STATES = {"success": "done", "timeout": "timeout", "cancelled": "cancelled"}
+
+class BatchJob:
+    """
+    Tracks the per-device state and results of one asynchronous batch.
+    Updated from worker threads, read from request handlers.
+    kind is "commands" for command batches and "detect" for device type detection.
+    """
+    def __init__(self, device_names, commands, context, kind="commands"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.commands = list(commands)
+        self.context = context
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        # Preserve submission order, ignore duplicate names
+        self.device_names = list(dict.fromkeys(device_names))
+        self.devices = {name: {"state": "queued"} for name in self.device_names}
+        self.results = {}
+        self.futures = {}
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def set_state(self, device_name, state):
+        with self.lock:
+            self.devices[device_name]["state"] = state
+
+    def record_result(self, result):
+        with self.lock:
+            name = result["device"]
+            if name in self.results:
+                return
+            self.results[name] = result
+            self.devices[name]["state"] = RESULT_STATES.get(result["status"], "failed")
+            if len(self.results) == len(self.device_names):
+                self.finished_at = datetime.now().isoformat()
+                self.context.finish()
+                metrics.batch_jobs_active.dec()
+                metrics.batch_jobs_finished_total.inc()
+
+    def cancel(self):
+        """
+        Stops the job: queued devices are dropped without connecting and running
+        devices are interrupted by closing their gateway channels.
+        Returns False, changing nothing, if the job had already finished.
+        """
+        with self.lock:
+            if self.finished_at:
+                return False
+            self.cancelled = True
+        self.context.stop("cancelled")
+        for name, future in list(self.futures.items()):
+            if future.cancel():
+                # Never started - record it here since no worker will
+                metrics.device_executions_total.inc(status="cancelled")
+                self.record_result({
+                    "device": name,
+                    "status": "cancelled",
+                    "output": "Batch cancelled before the device started"
+                })
+        return True
+
+    @property
+    def status(self):
+        if self.cancelled:
+            return "cancelled" if self.finished_at else "cancelling"
+        if self.finished_at:
+            return "completed"
+        if any(d["state"] != "queued" for d in self.devices.values()):
+            return "running"
+        return "queued"
+
+    def summary(self):
+        """Returns job status with per-device states (no outputs)."""
+        with self.lock:
+            counts = {state: 0 for state in DEVICE_STATES}
+            for device in self.devices.values():
+                counts[device["state"]] += 1
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "commands": self.commands,
+                "status": self.status,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "total": len(self.device_names),
+                "completed": len(self.results),
+                "counts": counts,
+                "timings": summarize_timings(self.results.values()),
+                "devices": {name: dict(d) for name, d in self.devices.items()}
+            }
+
+    def get_results(self):
+        """Returns results of finished devices, in submission order."""
+        with self.lock:
+            return [self.results[name] for name in self.device_names if name in self.results]
+
+class JobManager:
+    """
+    Submits batch jobs to the shared BatchExecutor pool and keeps them
+    available for polling. Command outputs are also kept in the result store,
+    keyed by job ID, after the job itself has been pruned from memory.
+    """
+    def __init__(self, executor, max_finished_jobs=MAX_FINISHED_JOBS):
+        self.executor = executor
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, device_names, commands, gateway_session, data_manager, context=None):
+        """Queues every device of a new job and returns the job immediately."""
+        job = BatchJob(device_names, commands, context or ExecutionContext())
+
+        def run(device_name, **kwargs):
+            return self.executor.run_device(device_name, job.commands, gateway_session, data_manager, job_id=job.id, **kwargs)
+        return self._start(job, run, data_manager)
+
+    def submit_detection(self, device_names, gateway_session, data_manager, context=None):
+        """Queues a device type detection job and returns the job immediately."""
+        job = BatchJob(device_names, [], context or ExecutionContext(), kind="detect")
+
+        def run(device_name, **kwargs):
+            return self.executor.detect_device(device_name, gateway_session, data_manager, **kwargs)
+        return self._start(job, run, data_manager)
+
+    def _start(self, job, run, data_manager):
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+
+        metrics.batch_jobs_active.inc()
+        if not job.device_names:
+            job.finished_at = job.created_at
+            job.context.finish()
+            metrics.batch_jobs_active.dec()
+            metrics.batch_jobs_finished_total.inc()
+
+        for name in self.executor.order_by_chain(job.device_names, data_manager):
+            job.futures[name] = self.executor.pool.submit(self._run_device, job, name, run)
+        return job
+
+    def _run_device(self, job, device_name, run):
+        result = run(
+            device_name,
+            on_state=lambda state: job.set_state(device_name, state),
+            context=job.context
+        )
+        job.record_result(result)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.summary() for job in jobs]
+
+    def _prune(self):
+        """Drops the oldest finished jobs beyond max_finished_jobs."""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
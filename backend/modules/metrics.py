@@ -0,0 +1,197 @@
+import threading
+
+# Default latency buckets (seconds), sized for SSH work rather than web requests
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base class for a named metric with optional labels."""
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirrors a running total kept elsewhere (used by scrape-time collectors)."""
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Holds the process metrics and renders them in the Prometheus text format.
+    Collectors are callables run at scrape time to refresh gauges from other modules.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+registry = MetricsRegistry()
+
+# Batch execution
+batch_requests_total = registry.counter(
+    "netauto_batch_requests_total", "Batches submitted, by mode (execute, stream, job, detect).", ["mode"])
+batch_jobs_active = registry.gauge(
+    "netauto_batch_jobs_active", "Asynchronous batch jobs that have not finished.")
+batch_jobs_finished_total = registry.counter(
+    "netauto_batch_jobs_finished_total", "Asynchronous batch jobs that finished.")
+device_executions_total = registry.counter(
+    "netauto_device_executions_total", "Device executions, by result status.", ["status"])
+device_execution_seconds = registry.histogram(
+    "netauto_device_execution_seconds", "Wall time of one device execution, by stage.", ["stage"])
+
+# Gateway and sessions
+gateway_channel_opens_total = registry.counter(
+    "netauto_gateway_channel_opens_total", "Gateway channel opens, by outcome (success, rejected, failed).", ["outcome"])
+gateway_channels_active = registry.gauge(
+    "netauto_gateway_channels_active", "Open device channels across all gateway transports.")
+gateway_chains = registry.gauge(
+    "netauto_gateway_chains", "Gateway sessions held in the per-chain registry.")
+session_pool_size = registry.gauge(
+    "netauto_session_pool_size", "Warm device sessions in the session pool.")
+session_pool_lookups_total = registry.counter(
+    "netauto_session_pool_lookups_total", "Session pool lookups, by result (hit, miss).", ["result"])
+
+# Data files
+data_file_operations_total = registry.counter(
+    "netauto_data_file_operations_total", "DataManager JSON file reads and writes.", ["operation"])
+
+# HTTP
+http_requests_total = registry.counter(
+    "netauto_http_requests_total", "HTTP requests, by router, method and status code.", ["router", "method", "status"])
+http_request_seconds = registry.histogram(
+    "netauto_http_request_seconds", "HTTP request latency, by router.", ["router"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+
+def collect_shared_stats():
+    """Copies counters kept by the shared modules into the registry at scrape time."""
+    from backend.modules.data_manager import io_stats
+    from backend.modules.session_pool import session_pool
+    from backend.modules.ssh_manager import channel_stats, gateway_registry
+
+    for outcome, value in channel_stats.items():
+        gateway_channel_opens_total.set_total(value, outcome=outcome)
+    gateway_channels_active.set(gateway_registry.active_channels())
+    gateway_chains.set(gateway_registry.get_stats()["chains"])
+
+    pool_stats = session_pool.get_stats()
+    session_pool_size.set(pool_stats["size"])
+    session_pool_lookups_total.set_total(pool_stats["hits"], result="hit")
+    session_pool_lookups_total.set_total(pool_stats["misses"], result="miss")
+
+    for operation, value in io_stats.items():
+        data_file_operations_total.set_total(value, operation=operation)
+
+registry.add_collector(collect_shared_stats)
@@ -0,0 +1,336 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+RESULTS_DIR = os.environ.get("RESULT_STORE_DIR", os.path.join("data", "results"))
+# gzip level for stored outputs; CLI output compresses well even at the default
+COMPRESSION_LEVEL = int(os.environ.get("RESULT_STORE_COMPRESSION", "6"))
+# Bytes read from a blob per step while streaming an archive
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+def safe_name(text):
+    """File-name friendly version of a device name or command."""
+    return "".join([c if c.isalnum() else "_" for c in text])
+
+def _entry_key(entry):
+    return (entry["job_id"], entry["device"], entry["command"], entry["hash"], entry["created_at"])
+
+class _ZipStream:
+    """
+    Write-only file object for ZipFile that hands out what was written so far,
+    so an archive can be streamed without a temporary file.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+class ResultStore:
+    """
+    Stores command outputs keyed by job, device and command.
+
+    Outputs are gzip-compressed and content-addressed: a blob is named after the
+    SHA-256 of the output (blobs/ab/abcd...gz), so an output that did not change
+    between runs is stored only once. A small append-only index (index.jsonl)
+    maps each (job, device, command) to its blob.
+
+    The backend and the Streamlit app may share one store directory, so index
+    appends and compaction also take an exclusive lock on index.lock.
+    """
+    def __init__(self, root=RESULTS_DIR):
+        self.root = root
+        self.index_file = os.path.join(root, "index.jsonl")
+        self.lock_file = os.path.join(root, "index.lock")
+        self.entries = []
+        self.by_job = {}
+        # hash -> compressed size on disk
+        self.blobs = {}
+        self.lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        """Reads the index on first use (called with the lock held)."""
+        if self._loaded:
+            return
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        for entry in self._read_index():
+            self._add(entry)
+        self._loaded = True
+
+    def _read_index(self):
+        entries = []
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Torn last line after a crash; the blob is still there
+                        continue
+        return entries
+
+    @contextmanager
+    def _index_lock(self):
+        """Exclusive lock on the index shared with other processes using the same directory."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.lock_file, 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        self.by_job.setdefault(entry["job_id"], []).append(entry)
+        self.blobs[entry["hash"]] = entry["stored_size"]
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], f"{digest}.gz")
+
+    def put(self, job_id, device, command, output, status="success"):
+        """
+        Stores one output and returns its index entry.
+        command is None for a device that failed before running any command.
+        """
+        data = (output or "").encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+
+        with self.lock:
+            self._load()
+            stored_size = self.blobs.get(digest)
+
+        if stored_size is None:
+            stored_size = self._write_blob(path, data)
+
+        entry = {
+            "job_id": job_id,
+            "device": device,
+            "command": command,
+            "status": status,
+            "hash": digest,
+            "size": len(data),
+            "stored_size": stored_size,
+            "created_at": datetime.now().isoformat()
+        }
+        with self.lock, self._index_lock():
+            if not os.path.exists(path):
+                # Evicted (possibly by another process) between the lookup above and now
+                entry["stored_size"] = self._write_blob(path, data)
+            with open(self.index_file, 'a') as f:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._add(entry)
+        return entry
+
+    def _write_blob(self, path, data):
+        """Writes a compressed blob atomically and returns its size on disk."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=COMPRESSION_LEVEL))
+        # Identical content from another thread is harmless to overwrite
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def remove(self, entries):
+        """
+        Drops entries from the index and deletes the blobs no other entry uses.
+        The index is re-read from disk under the index lock first, so entries
+        another process added in the meantime are kept.
+
+        Returns:
+            dict: {"entries", "blobs", "bytes"} removed.
+        """
+        drop = {_entry_key(entry) for entry in entries}
+        if not drop:
+            return {"entries": 0, "blobs": 0, "bytes": 0}
+        with self.lock, self._index_lock():
+            self._load()
+            current = self._read_index()
+            kept = [entry for entry in current if _entry_key(entry) not in drop]
+            removed = len(current) - len(kept)
+            if not removed:
+                return {"entries": 0, "blobs": 0, "bytes": 0}
+            referenced = {entry["hash"] for entry in kept}
+            sizes = {entry["hash"]: entry["stored_size"] for entry in current}
+            orphans = {digest: size for digest, size in sizes.items() if digest not in referenced}
+
+            # Rewrite the index without the dropped entries
+            tmp_path = f"{self.index_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                for entry in kept:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            os.replace(tmp_path, self.index_file)
+
+            self.entries, self.by_job, self.blobs = [], {}, {}
+            for entry in kept:
+                self._add(entry)
+
+            for digest in orphans:
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+        return {"entries": removed, "blobs": len(orphans), "bytes": sum(orphans.values())}
+
+    def list_entries(self):
+        """Every index entry, oldest first."""
+        with self.lock:
+            self._load()
+            return list(self.entries)
+
+    def put_result(self, job_id, result):
+        """
+        Stores every command output of a batch result (see BatchExecutor.run_device)
+        and returns the index entries. A device without command output is stored
+        once with its error text.
+        """
+        entries = []
+        for command_result in result.get("commands") or []:
+            if command_result["status"] == "skipped":
+                continue
+            entries.append(self.put(
+                job_id, result["device"], command_result["command"],
+                command_result["output"], command_result["status"]
+            ))
+        if not entries:
+            entries.append(self.put(job_id, result["device"], None, result.get("output", ""), result["status"]))
+        return entries
+
+    def read(self, entry):
+        """Returns the decompressed output of an index entry."""
+        return self.read_bytes(entry).decode("utf-8")
+
+    def read_bytes(self, entry):
+        with open(self._blob_path(entry["hash"]), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def iter_archive(self, entries, chunk_size=ARCHIVE_CHUNK_SIZE):
+        """
+        Yields a DEFLATE-compressed ZIP of the given entries chunk by chunk.
+        Blobs are decompressed and recompressed in chunks, so memory use does
+        not depend on the size of the outputs.
+        """
+        stream = _ZipStream()
+        names = set()
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for entry in entries:
+                name = self.archive_name(entry)
+                base, count = name[:-len(".txt")], 1
+                while name in names:
+                    count += 1
+                    name = f"{base}_{count}.txt"
+                names.add(name)
+
+                created = datetime.fromisoformat(entry["created_at"])
+                info = zipfile.ZipInfo(name, date_time=created.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                try:
+                    src = gzip.open(self._blob_path(entry["hash"]), 'rb')
+                except FileNotFoundError:
+                    print(f"Result blob {entry['hash']} missing, skipping {name}")
+                    continue
+                with src, zf.open(info, "w") as dest:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = stream.drain()
+                        if data:
+                            yield data
+                data = stream.drain()
+                if data:
+                    yield data
+        # Central directory
+        yield stream.drain()
+
+    def get(self, job_id, device, command):
+        """Returns the latest stored output for (job, device, command), or None."""
+        for entry in reversed(self.list_job(job_id)):
+            if entry["device"] == device and entry["command"] == command:
+                return self.read(entry)
+        return None
+
+    def list_job(self, job_id):
+        """Index entries of one job, in the order they were stored."""
+        with self.lock:
+            self._load()
+            return list(self.by_job.get(job_id, []))
+
+    def list_jobs(self):
+        """One summary per stored job: entries, devices and sizes."""
+        with self.lock:
+            self._load()
+            jobs = {job_id: list(entries) for job_id, entries in self.by_job.items()}
+        return [
+            {
+                "job_id": job_id,
+                "entries": len(entries),
+                "devices": len({e["device"] for e in entries}),
+                "size": sum(e["size"] for e in entries),
+                "created_at": entries[0]["created_at"]
+            }
+            for job_id, entries in jobs.items()
+        ]
+
+    def archive_name(self, entry):
+        """File name of an entry inside a download archive."""
+        if entry["command"] is None:
+            return f"{entry['device']}_{entry['status']}.txt"
+        return f"{entry['device']}_{safe_name(entry['command'])}.txt"
+
+    def get_stats(self):
+        with self.lock:
+            self._load()
+            raw = sum(e["size"] for e in self.entries)
+            stored = sum(self.blobs.values())
+            return {
+                "entries": len(self.entries),
+                "jobs": len(self.by_job),
+                "blobs": len(self.blobs),
+                "raw_bytes": raw,
+                "stored_bytes": stored,
+                "ratio": round(raw / stored, 2) if stored else 0.0
+            }
+
+# Process-wide store shared by the batch paths
+result_store = ResultStore()
@@ -0,0 +1,155 @@
+import glob
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Stored outputs older than this many days are evicted (0 disables the rule)
+RETENTION_MAX_AGE_DAYS = float(os.environ.get("RESULT_RETENTION_MAX_AGE_DAYS", "30"))
+# Compressed size the result store may use on disk (0 disables the rule)
+RETENTION_MAX_BYTES = int(os.environ.get("RESULT_RETENTION_MAX_BYTES", "0"))
+# Most recent jobs kept per device (0 disables the rule)
+RETENTION_KEEP_LAST = int(os.environ.get("RESULT_RETENTION_KEEP_LAST", "0"))
+# Seconds between background retention runs
+RETENTION_INTERVAL = float(os.environ.get("RESULT_RETENTION_INTERVAL", "3600"))
+# Seconds a /batch/download archive in the temp directory is kept
+TEMP_ARCHIVE_MAX_AGE = float(os.environ.get("TEMP_ARCHIVE_MAX_AGE", "3600"))
+
+class RetentionEngine:
+    """
+    Evicts stored batch outputs by age, total size and number of jobs per device,
+    oldest first, and deletes leftover download files: the /batch/download
+    archives in the temp directory and loose files in the legacy downloads/
+    directory. Runs periodically in a background thread once started.
+    """
+    def __init__(self, store, max_age_days=RETENTION_MAX_AGE_DAYS, max_bytes=RETENTION_MAX_BYTES,
+                 keep_last=RETENTION_KEEP_LAST, interval=RETENTION_INTERVAL, temp_archive_max_age=TEMP_ARCHIVE_MAX_AGE):
+        self.store = store
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.keep_last = keep_last
+        self.interval = interval
+        self.temp_archive_max_age = temp_archive_max_age
+        self.lock = threading.Lock()
+        self.totals = {"runs": 0, "entries": 0, "blobs": 0, "files": 0, "bytes": 0}
+        self.last_run = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def select(self, entries):
+        """Returns the entries that break a retention rule."""
+        evict = {}
+
+        if self.max_age_days:
+            cutoff = datetime.now() - timedelta(days=self.max_age_days)
+            for entry in entries:
+                if datetime.fromisoformat(entry["created_at"]) < cutoff:
+                    evict[id(entry)] = entry
+
+        if self.keep_last:
+            # Per device, newest job first
+            jobs_by_device = {}
+            for entry in reversed(entries):
+                jobs = jobs_by_device.setdefault(entry["device"], [])
+                if entry["job_id"] not in jobs:
+                    jobs.append(entry["job_id"])
+            for entry in entries:
+                if entry["job_id"] not in jobs_by_device[entry["device"]][:self.keep_last]:
+                    evict[id(entry)] = entry
+
+        if self.max_bytes:
+            # Drop the oldest remaining entries until the blobs still referenced fit
+            kept = [entry for entry in entries if id(entry) not in evict]
+            refs, sizes = {}, {}
+            for entry in kept:
+                refs[entry["hash"]] = refs.get(entry["hash"], 0) + 1
+                sizes[entry["hash"]] = entry["stored_size"]
+            total = sum(sizes.values())
+            for entry in kept:
+                if total <= self.max_bytes:
+                    break
+                evict[id(entry)] = entry
+                refs[entry["hash"]] -= 1
+                if not refs[entry["hash"]]:
+                    total -= sizes[entry["hash"]]
+
+        return list(evict.values())
+
+    def clean_files(self):
+        """Deletes expired download files. Returns (files, bytes) removed."""
+        now = time.time()
+        targets = [(os.path.join(tempfile.gettempdir(), "batch_results_*.zip"), self.temp_archive_max_age)]
+        if self.max_age_days:
+            targets.append((os.path.join("downloads", "*.txt"), self.max_age_days * 86400))
+
+        files, freed = 0, 0
+        for pattern, max_age in targets:
+            for path in glob.glob(pattern):
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime < max_age:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                files += 1
+                freed += stat.st_size
+        return files, freed
+
+    def run(self):
+        """Applies the retention rules once and returns what was reclaimed."""
+        start = time.monotonic()
+        evicted = self.store.remove(self.select(self.store.list_entries()))
+        files, file_bytes = self.clean_files()
+        report = {
+            "finished_at": datetime.now().isoformat(),
+            "duration": round(time.monotonic() - start, 3),
+            "entries": evicted["entries"],
+            "blobs": evicted["blobs"],
+            "files": files,
+            "bytes": evicted["bytes"] + file_bytes
+        }
+        with self.lock:
+            self.last_run = report
+            self.totals["runs"] += 1
+            for key in ("entries", "blobs", "files", "bytes"):
+                self.totals[key] += report[key]
+        if report["entries"] or report["files"]:
+            print(f"Retention reclaimed {report['bytes']} bytes ({report['entries']} results, {report['files']} files)")
+        return report
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "policy": {
+                    "max_age_days": self.max_age_days,
+                    "max_bytes": self.max_bytes,
+                    "keep_last": self.keep_last,
+                    "interval": self.interval
+                },
+                "running": bool(self._thread and self._thread.is_alive()),
+                "last_run": self.last_run,
+                "reclaimed": dict(self.totals),
+                "store": self.store.get_stats()
+            }
+
+    def start(self):
+        """Starts the background retention thread (once per process)."""
+        with self.lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="result-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception as e:
+                print(f"Retention run failed: {e}")
+            self._stop.wait(self.interval)
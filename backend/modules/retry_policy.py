@@ -0,0 +1,153 @@
+import os
+import random
+import socket
+import threading
+import time
+import paramiko
+from netmiko.exceptions import NetmikoAuthenticationException, NetmikoTimeoutException, ReadTimeout
+
+# Attempts per device (first try included) for transient connection errors
+RETRY_MAX_ATTEMPTS = int(os.environ.get("DEVICE_RETRY_ATTEMPTS", "3"))
+# Backoff before the n-th retry is a random delay up to min(max, base * 2 ** (n - 1)) seconds
+RETRY_BASE_DELAY = float(os.environ.get("DEVICE_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("DEVICE_RETRY_MAX_DELAY", "30"))
+# Retries shared by all devices of one batch, so a dead site cannot stall the batch
+BATCH_RETRY_BUDGET = int(os.environ.get("BATCH_RETRY_BUDGET", "50"))
+
+# Channel open failures that mean "bastion is overloaded", not "device unreachable"
+THROTTLE_CODES = (
+    paramiko.common.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED,
+    paramiko.common.OPEN_FAILED_RESOURCE_SHORTAGE,
+)
+
+# Error texts (lowercase) of name resolution failures, wherever they were raised
+UNKNOWN_HOST_MARKERS = (
+    "not resolvable",
+    "name or service not known",
+    "nodename nor servname",
+    "getaddrinfo failed",
+    "no address associated",
+    "temporary failure in name resolution",
+)
+
+class RetryPolicy:
+    """
+    How often an error class is retried and how long to back off in between.
+    max_attempts=1 means the error is permanent and never retried.
+    """
+    def __init__(self, max_attempts=1, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Jittered exponential backoff (full jitter) after the given failed attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+# Error class -> policy. Bad credentials and unknown hosts fail the same way every time.
+# Throttled opens are already retried inside GatewaySession.open_channel until its
+# queue time runs out, so retrying them here would only multiply that wait.
+RETRY_POLICIES = {
+    "auth": RetryPolicy(1),
+    "unknown_host": RetryPolicy(1),
+    "throttled": RetryPolicy(1),
+    "timeout": RetryPolicy(RETRY_MAX_ATTEMPTS),
+    "connection": RetryPolicy(RETRY_MAX_ATTEMPTS),
+    "error": RetryPolicy(1),
+}
+
+def _classify(error):
+    message = str(error).lower()
+    if isinstance(error, (NetmikoAuthenticationException, paramiko.AuthenticationException)):
+        return "auth"
+    if isinstance(error, socket.gaierror) or any(marker in message for marker in UNKNOWN_HOST_MARKERS):
+        return "unknown_host"
+    if isinstance(error, paramiko.ChannelException):
+        return "throttled" if error.code in THROTTLE_CODES else "connection"
+    if isinstance(error, (NetmikoTimeoutException, ReadTimeout, socket.timeout)) or "timed out" in message:
+        return "timeout"
+    if "authentication" in message:
+        return "auth"
+    if isinstance(error, (paramiko.SSHException, EOFError, OSError)):
+        return "connection"
+    return "error"
+
+def classify_error(error):
+    """
+    Returns the error class of an exception: auth, unknown_host, throttled,
+    timeout, connection or error (anything unrecognised).
+    Wrapped exceptions are classified by their cause.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        error_class = _classify(error)
+        if error_class != "error":
+            return error_class
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return "error"
+
+class RetryBudget:
+    """
+    Retries left for one batch, shared by its worker threads.
+    """
+    def __init__(self, total=BATCH_RETRY_BUDGET):
+        self.total = total
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Claims one retry; returns False once the budget is spent."""
+        with self.lock:
+            if self.used >= self.total:
+                return False
+            self.used += 1
+            return True
+
+    def get_stats(self):
+        with self.lock:
+            return {"total": self.total, "used": self.used, "remaining": self.total - self.used}
+
+def _sleep(delay):
+    time.sleep(delay)
+    return False
+
+class RetryState:
+    """
+    Retries one device's operation according to the policy of each error it raises.
+    attempts and errors (error class per failed attempt) are kept for the result.
+
+    Args:
+        budget (RetryBudget): Batch-wide retry budget; None means unlimited.
+        wait (callable): Called with the backoff delay; returns True to give up instead
+            (e.g. the batch was cancelled). Defaults to sleeping.
+    """
+    def __init__(self, budget=None, wait=None, policies=None):
+        self.budget = budget
+        self.wait = wait or _sleep
+        self.policies = policies or RETRY_POLICIES
+        self.attempts = 0
+        self.errors = []
+
+    def run(self, operation):
+        while True:
+            self.attempts += 1
+            try:
+                return operation()
+            except Exception as e:
+                error_class = classify_error(e)
+                self.errors.append(error_class)
+                policy = self.policies.get(error_class, self.policies["error"])
+                if self.attempts >= policy.max_attempts:
+                    raise
+                if self.budget and not self.budget.take():
+                    raise
+                delay = policy.delay(self.attempts)
+                print(f"Attempt {self.attempts} failed ({error_class}: {e}), retrying in {delay:.1f}s")
+                if self.wait(delay):
+                    raise
+
+    @property
+    def error_class(self):
+        """Class of the last error, or None if the last attempt succeeded."""
+        return self.errors[-1] if self.errors and len(self.errors) == self.attempts else None
@@ -0,0 +1,161 @@
+import re
+
+# Quoted tag, parenthesis, or a run of anything else up to whitespace or a parenthesis
+TOKEN_PATTERN = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|(\()|(\))|([^\s()"]+))')
+
+OPERATORS = ("AND", "OR", "NOT")
+
+# Deepest nesting of parentheses and NOTs a parser will follow
+MAX_NESTING = 100
+
+def quote_tag(tag):
+    """Writes a tag so parse_tag_query reads it back as one tag, whatever it contains."""
+    if re.fullmatch(r'[^\s()"\\]+', tag) and tag.upper() not in OPERATORS:
+        return tag
+    return '"' + tag.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ValueError(f"Unterminated quote at position {position + 1}")
+        quoted, opening, closing, word = match.groups()
+        if quoted is not None:
+            tokens.append(("tag", re.sub(r'\\(.)', r'\1', quoted)))
+        elif opening:
+            tokens.append(("(", None))
+        elif closing:
+            tokens.append((")", None))
+        elif word.upper() in OPERATORS:
+            tokens.append((word.upper(), None))
+        else:
+            tokens.append(("tag", word))
+        position = match.end()
+    return tokens
+
+class _Parser:
+    """
+    Recursive descent over the grammar
+        expression := term (OR term)*
+        term       := factor (AND factor)*
+        factor     := NOT factor | "(" expression ")" | tag
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expression(self):
+        terms = [self.term()]
+        while self.peek() == "OR":
+            self.take()
+            terms.append(self.term())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def term(self):
+        factors = [self.factor()]
+        while self.peek() == "AND":
+            self.take()
+            factors.append(self.factor())
+        return factors[0] if len(factors) == 1 else ("and", factors)
+
+    def nested(self, parse):
+        self.depth += 1
+        if self.depth > MAX_NESTING:
+            raise ValueError("Expression nested too deeply")
+        node = parse()
+        self.depth -= 1
+        return node
+
+    def factor(self):
+        kind = self.peek()
+        if kind == "NOT":
+            self.take()
+            return ("not", self.nested(self.factor))
+        if kind == "(":
+            self.take()
+            node = self.nested(self.expression)
+            if self.peek() != ")":
+                raise ValueError("Missing closing parenthesis")
+            self.take()
+            return node
+        if kind == "tag":
+            return self.take()
+        if kind is None:
+            raise ValueError("Expression ends where a tag was expected")
+        raise ValueError(f"Expected a tag, found {kind}")
+
+def parse_tag_query(expression):
+    """
+    Parses a tag expression such as 'core AND (dc1 OR dc2) AND NOT lab' into a
+    tree of ("tag", name), ("not", node), ("and", [nodes]) and ("or", [nodes]).
+    Operators are case-insensitive; NOT binds tightest, then AND, then OR.
+    Tags containing spaces, parentheses or an operator name are written in
+    double quotes. Raises ValueError for malformed expressions.
+    """
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise ValueError("Empty tag expression")
+    parser = _Parser(tokens)
+    node = parser.expression()
+    if parser.peek() is not None:
+        raise ValueError(f"Unexpected {parser.peek()} after a complete expression (missing AND/OR?)")
+    return node
+
+def evaluate_tag_query(node, members, universe):
+    """
+    Returns the set of devices matching a parsed expression.
+
+    Args:
+        members (callable): tag -> set of devices carrying it (the inverted index).
+        universe (callable): -> set of every device; only called for a NOT that
+            cannot be applied as a difference (e.g. 'NOT lab' on its own).
+    """
+    everything = []
+
+    def all_devices():
+        if not everything:
+            everything.append(universe())
+        return everything[0]
+
+    def visit(node):
+        kind = node[0]
+        if kind == "tag":
+            return set(members(node[1]))
+        if kind == "or":
+            result = set()
+            for child in node[1]:
+                result |= visit(child)
+            return result
+        if kind == "not":
+            return all_devices() - visit(node[1])
+        # AND: intersect the positive terms, smallest first, then subtract the negated ones
+        positive = [visit(child) for child in node[1] if child[0] != "not"]
+        negative = [child[1] for child in node[1] if child[0] == "not"]
+        if positive:
+            positive.sort(key=len)
+            result = positive[0]
+            for other in positive[1:]:
+                if not result:
+                    break
+                result &= other
+        else:
+            result = set(all_devices())
+        for child in negative:
+            if not result:
+                break
+            result -= visit(child)
+        return result
+
+    return visit(node)
@@ -1,7 +1,7 @@
 import streamlit as st
-import os
 from datetime import datetime
 from modules.styles import card_container, close_card
+from modules.tag_query import parse_tag_query, quote_tag
 
 import streamlit_antd_components as sac
 
@@ -270,16 +270,20 @@ def render_dashboard_content(logs):
 
     # Download Section
     if 'last_generated_file' in st.session_state and st.session_state['last_generated_file']:
-        filepath = st.session_state['last_generated_file']
-        if os.path.exists(filepath):
-            with open(filepath, "r") as f:
-                st.download_button(
-                    label="Download Output 📥",
-                    data=f,
-                    file_name=os.path.basename(filepath),
-                    mime="text/plain",
-                    use_container_width=True
-                )
+        from modules.result_store import result_store
+        entry = st.session_state['last_generated_file']
+        try:
+            output = result_store.read(entry)
+        except FileNotFoundError:
+            output = None
+        if output is not None:
+            st.download_button(
+                label="Download Output 📥",
+                data=output,
+                file_name=result_store.archive_name(entry),
+                mime="text/plain",
+                use_container_width=True
+            )
     return None
 
 def render_batch_page(data_manager):
@@ -289,33 +293,39 @@ def render_batch_page(data_manager):
     
     # Step 1: Select Devices
     with st.expander("1️⃣ Select Target Devices", expanded=True):
-        devices_list = data_manager.get_all_devices_list()
-        
-        if not devices_list:
+        if not len(data_manager.inventory):
             st.info("No devices found in inventory.")
             # Do not return here, allow the rest of the page to render with an empty selection
             selected_devices = []
         else:
-            # Tag Filter
-            all_tags = set()
-            for d in devices_list:
-                if 'tags' in d:
-                    all_tags.update(d['tags'])
-            
-            col_filter, col_info = st.columns([3, 1])
+            # Tag Filter (answered from the data layer's tag index)
+            col_filter, col_expression, col_info = st.columns([2, 2, 1])
             with col_filter:
-                selected_tags = st.multiselect("Filter by Tag", list(all_tags))
+                selected_tags = st.multiselect("Filter by Tag", list(data_manager.get_tag_counts()))
+            with col_expression:
+                tag_expression = st.text_input("Tag Expression", placeholder="core AND (dc1 OR dc2) AND NOT lab")
             
-            # Filter devices based on tags
+            # Any selected tag matches; an expression narrows the selection further
+            clauses = []
             if selected_tags:
-                filtered_devices = []
-                for d in devices_list:
-                    device_tags = set(d.get('tags', []))
-                    if not device_tags.isdisjoint(selected_tags):
-                        filtered_devices.append(d)
-                devices_list = filtered_devices
+                clauses.append("(" + " OR ".join(quote_tag(t) for t in selected_tags) + ")")
+            if tag_expression.strip():
+                clauses.append(f"({tag_expression})")
+            
+            if clauses:
+                try:
+                    if tag_expression.strip():
+                        # Check it alone, so the parentheses added above cannot hide an error
+                        parse_tag_query(tag_expression)
+                    matches = data_manager.query_devices(" AND ".join(clauses))
+                except ValueError as e:
+                    st.error(f"Invalid tag expression: {e}")
+                    matches = []
+                devices_list = data_manager.get_devices_list(matches)
                 with col_info:
                     st.caption(f"Matches: {len(devices_list)}")
+            else:
+                devices_list = data_manager.get_all_devices_list()
 
             # Configure Column Config for Batch Selection
             column_config = {
@@ -347,22 +357,29 @@ def render_batch_page(data_manager):
 
     # Step 2: Enter Command
     if selected_devices:
-        with st.expander("2️⃣ Enter Command", expanded=True):
-            command = st.text_input("Command to Execute", placeholder="e.g., show version")
+        with st.expander("2️⃣ Enter Commands", expanded=True):
+            command_text = st.text_area("Commands to Execute (one per line)", placeholder="e.g., show version\nshow inventory")
+            commands = [c.strip() for c in command_text.splitlines() if c.strip()]
             
-            if command:
+            if commands:
                 if st.button("🚀 Run Batch Command", type="primary"):
                     from modules.batch_manager import BatchProcessor
                     batch_manager = BatchProcessor(data_manager) # Instantiate here
                     
                     with st.status("Executing Batch...", expanded=True) as status:
                         gateway_session = st.session_state.get('gateway_session')
-                        results = batch_manager.execute_batch(selected_devices, command, gateway_session)
+                        results = {}
+                        progress = st.progress(0.0)
+                        for res in batch_manager.iter_batch(selected_devices, commands, gateway_session):
+                            results[res['device']] = res
+                            icon = "✅" if res['status'] == 'success' else "❌"
+                            status.write(f"{icon} {res['device']}")
+                            progress.progress(len(results) / len(selected_devices))
                         status.update(label="Batch execution complete!", state="complete", expanded=False)
                     
                     # Store results in session state to persist
                     st.session_state['batch_results'] = results
-                    st.session_state['last_batch_command'] = command
+                    st.session_state['last_batch_command'] = "; ".join(commands)
     
     # Step 3: View Results
     if 'batch_results' in st.session_state:
@@ -383,7 +400,7 @@ def render_batch_page(data_manager):
         
         # Results Table
         res_data = []
-        files_to_zip = [] # Initialize files_to_zip for the download section
+        files_to_zip = [] # Stored result entries for the download section
         
         for dev_name, res in results.items(): # Iterate over items for device name and result dict
             status_icon = "✅" if res['status'] == 'success' else "❌"
@@ -392,22 +409,34 @@ def render_batch_page(data_manager):
             res_data.append({
                 "Device": dev_name,
                 "Status": f"{status_icon} {res['status'].upper()}",
+                "Attempts": res.get('attempts', 1),
                 "Output": output_preview
             })
-            if res.get('file'):
-                files_to_zip.append(res['file'])
+            files_to_zip.extend(res.get('stored', []))
 
         st.dataframe(res_data, use_container_width=True)
+
+        # Where the time went, per stage across all devices
+        from modules.device_manager import summarize_timings
+        stage_summary = summarize_timings(results.values())
+        if stage_summary:
+            with st.expander("⏱️ Stage Timings (seconds)"):
+                st.dataframe(
+                    [{"Stage": stage, **stats} for stage, stats in stage_summary.items()],
+                    use_container_width=True,
+                    hide_index=True
+                )
         
         # 5. Bulk Download
         if files_to_zip:
             import zipfile
             import io
+            from modules.result_store import result_store
             
             zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for file_path in files_to_zip:
-                    zf.write(file_path, os.path.basename(file_path))
+            with zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for entry in files_to_zip:
+                    zf.writestr(result_store.archive_name(entry), result_store.read_bytes(entry))
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             zip_filename = f"batch_output_{timestamp}.zip"
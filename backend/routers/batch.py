@@ -1,107 +1,233 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from backend.dependencies import get_data_manager
 from backend.modules.data_manager import DataManager
-from backend.modules.device_manager import DeviceConnection
-from pydantic import BaseModel
-from typing import List, Optional
+from backend.modules.batch_executor import ExecutionContext, batch_executor
+from backend.modules.job_manager import JobManager
+from backend.modules.result_store import result_store
+from backend.modules.retention import RetentionEngine
+from backend.modules import metrics
+from pydantic import BaseModel, Field, model_validator
+from typing import Dict, List, Optional
+import json
+import uuid
 
 router = APIRouter(
     prefix="/batch",
     tags=["batch"]
 )
 
-data_manager = DataManager()
+job_manager = JobManager(batch_executor)
+retention_engine = RetentionEngine(result_store)
 
 class BatchCommand(BaseModel):
     device_names: List[str]
+    command: Optional[str] = None
+    commands: List[str] = []
+    # Seconds; unset means Netmiko's defaults and no batch deadline
+    connect_timeout: Optional[float] = Field(default=None, gt=0)
+    command_timeout: Optional[float] = Field(default=None, gt=0)
+    deadline: Optional[float] = Field(default=None, gt=0)
+    # Connection retries shared by all devices of the batch; unset means BATCH_RETRY_BUDGET
+    retry_budget: Optional[int] = Field(default=None, ge=0)
+
+    @model_validator(mode="after")
+    def check_commands(self):
+        if not self.get_commands():
+            raise ValueError("Provide 'command' or a non-empty 'commands' list")
+        return self
+
+    def get_commands(self):
+        """Ordered list of commands to run; a single `command` is still accepted."""
+        commands = ([self.command] if self.command else []) + self.commands
+        return [c for c in commands if c.strip()]
+
+    def get_context(self):
+        """Timeouts, deadline and retry budget for this batch; the deadline clock starts now."""
+        return ExecutionContext(self.connect_timeout, self.command_timeout, self.deadline, self.retry_budget)
+
+class DeviceDetection(BaseModel):
+    # Empty means every device in the inventory
+    device_names: List[str] = []
+    # Skip devices whose type was already autodetected
+    only_undetected: bool = False
+    connect_timeout: Optional[float] = Field(default=None, gt=0)
+    deadline: Optional[float] = Field(default=None, gt=0)
+    retry_budget: Optional[int] = Field(default=None, ge=0)
+
+    def get_device_names(self, data_manager):
+        names = self.device_names or list(data_manager.inventory)
+        if self.only_undetected:
+            names = [
+                name for name in names
+                if not (data_manager.get_device(name) or {}).get("device_type_detected_at")
+            ]
+        return names
+
+class CommandResult(BaseModel):
     command: str
+    status: str
+    output: str
+    duration: float
 
 class BatchResult(BaseModel):
     device: str
     status: str
     output: str
+    commands: List[CommandResult] = []
+    timings: Dict[str, float] = {}
+    attempts: int = 1
+    error_class: Optional[str] = None
 
 @router.post("/execute")
-async def execute_batch_command(batch: BatchCommand):
-    """Execute a command on multiple devices"""
-    results = []
+async def execute_batch_command(batch: BatchCommand, response: Response, data_manager: DataManager = Depends(get_data_manager)):
+    """
+    Execute one or more commands on multiple devices.
+    Outputs are stored under the job ID returned in the X-Job-Id header
+    (download them from /batch/jobs/{job_id}/archive).
+    """
+    # Get current gateway session dynamically (used by devices without a jump host profile)
+    from backend.routers.gateway import get_gateway_session
+    gateway_session = get_gateway_session()
     
-    # Get current gateway session dynamically
+    # Devices run concurrently on the shared worker pool, off the event loop,
+    # each through the gateway of its own jump host chain
+    metrics.batch_requests_total.inc(mode="execute")
+    job_id = uuid.uuid4().hex
+    response.headers["X-Job-Id"] = job_id
+    return await batch_executor.run_batch(
+        batch.device_names,
+        batch.get_commands(),
+        gateway_session,
+        data_manager,
+        batch.get_context(),
+        job_id
+    )
+
+@router.post("/execute/stream")
+async def execute_batch_command_stream(batch: BatchCommand, data_manager: DataManager = Depends(get_data_manager)):
+    """Execute commands on multiple devices, streaming each result as NDJSON"""
     from backend.routers.gateway import get_gateway_session
     gateway_session = get_gateway_session()
     
-    # Reload DataManager to get latest inventory
-    fresh_data_manager = DataManager()
+    metrics.batch_requests_total.inc(mode="stream")
+    job_id = uuid.uuid4().hex
     
-    # Check if gateway is connected
-    if not gateway_session or not gateway_session.is_active():
-        return [{
-            "device": "Gateway",
-            "status": "error",
-            "output": "Gateway session not connected. Please connect to gateway first."
-        }]
+    async def stream_results():
+        async for result in batch_executor.iter_batch(
+            batch.device_names,
+            batch.get_commands(),
+            gateway_session,
+            data_manager,
+            batch.get_context(),
+            job_id
+        ):
+            yield json.dumps(result) + "\n"
     
-    for device_name in batch.device_names:
-        if device_name not in fresh_data_manager.inventory:
-            results.append({
-                "device": device_name,
-                "status": "error",
-                "output": f"Device {device_name} not found in inventory"
-            })
-            continue
-        
-        device_data = fresh_data_manager.inventory[device_name]
-        
-        # Resolve credentials
-        cred_name = device_data.get("credential_name")
-        username = ""
-        password = ""
-        secret = ""
-        if cred_name and cred_name in fresh_data_manager.credentials:
-            cred = fresh_data_manager.credentials[cred_name]
-            username = cred['username']
-            password = cred['password']
-            secret = cred.get('secret', '')
-        else:
-            results.append({
-                "device": device_name,
-                "status": "error",
-                "output": f"Credentials '{cred_name}' not found"
-            })
-            continue
-        
-        # Execute command through gateway
-        try:
-            # Open a channel through the gateway to the device
-            sock = gateway_session.open_channel(device_data['host'], device_data['port'])
-            
-            # Connect to device using the gateway channel
-            device_connection = DeviceConnection()
-            device_connection.connect(
-                device_type=device_data['device_type'],
-                host=device_data['host'],  # This is used for reference only when sock is provided
-                port=device_data['port'],
-                username=username,
-                password=password,
-                secret=secret,
-                sock=sock  # Pass the gateway channel
-            )
-            
-            output = device_connection.send_command(batch.command)
-            device_connection.disconnect()
-            
-            results.append({
-                "device": device_name,
-                "status": "success",
-                "output": output
-            })
-        except Exception as e:
-            results.append({
-                "device": device_name,
-                "status": "error",
-                "output": f"Connection/execution failed: {str(e)}"
-            })
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson", headers={"X-Job-Id": job_id})
+
+@router.post("/jobs")
+async def create_batch_job(batch: BatchCommand, data_manager: DataManager = Depends(get_data_manager)):
+    """Start a batch in the background and return its job ID immediately"""
+    from backend.routers.gateway import get_gateway_session
+    gateway_session = get_gateway_session()
     
-    return results
+    metrics.batch_requests_total.inc(mode="job")
+    job = job_manager.submit(
+        batch.device_names,
+        batch.get_commands(),
+        gateway_session,
+        data_manager,
+        batch.get_context()
+    )
+    return {"job_id": job.id, "status": job.status, "total": len(job.device_names)}
+
+@router.post("/detect")
+async def create_detection_job(detection: DeviceDetection, data_manager: DataManager = Depends(get_data_manager)):
+    """Autodetect the Netmiko device_type of devices in the background and save it to the inventory"""
+    from backend.routers.gateway import get_gateway_session
+    gateway_session = get_gateway_session()
+
+    metrics.batch_requests_total.inc(mode="detect")
+    job = job_manager.submit_detection(
+        detection.get_device_names(data_manager),
+        gateway_session,
+        data_manager,
+        ExecutionContext(detection.connect_timeout, None, detection.deadline, detection.retry_budget)
+    )
+    return {"job_id": job.id, "status": job.status, "total": len(job.device_names)}
+
+@router.get("/jobs")
+async def list_batch_jobs():
+    """List known jobs with their progress"""
+    return job_manager.list_jobs()
+
+@router.get("/jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """Get job progress with per-device state"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.summary()
+
+@router.delete("/jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """
+    Cancel a job: drop queued devices, close in-flight channels, return partial results.
+    A job that already finished is returned unchanged.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.cancel()
+    return {**job.summary(), "results": job.get_results()}
+
+@router.get("/jobs/{job_id}/results")
+async def get_batch_job_results(job_id: str):
+    """Get results of the devices that have finished so far"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.get_results()
+
+@router.get("/jobs/{job_id}/archive")
+async def download_job_archive(job_id: str):
+    """Stream a ZIP of the stored outputs of a job, one .txt per device and command"""
+    entries = result_store.list_job(job_id)
+    if not entries:
+        raise HTTPException(status_code=404, detail="No stored results for this job")
+    filename = f"batch_results_{job_id}.zip"
+    return StreamingResponse(
+        result_store.iter_archive(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@router.get("/store")
+async def get_result_store_stats():
+    """Get size and deduplication statistics of the stored job outputs"""
+    return result_store.get_stats()
+
+@router.get("/retention")
+async def get_retention_stats():
+    """Get the retention policy, the last run and the space reclaimed so far"""
+    return retention_engine.get_stats()
+
+@router.post("/retention/run")
+def run_retention():
+    """Apply the retention policy now and return what was reclaimed"""
+    return retention_engine.run()
+
+@router.get("/sessions")
+async def get_session_pool_stats():
+    """Get hit/miss statistics of the warm device session pool"""
+    return batch_executor.session_pool.get_stats()
+
+@router.delete("/sessions")
+async def close_pooled_sessions():
+    """Close every idle pooled device session"""
+    batch_executor.session_pool.close_all()
+    return {"status": "closed"}
 
 from fastapi.responses import FileResponse
 import os
@@ -110,7 +236,10 @@ from datetime import datetime
 
 @router.post("/download")
 async def download_results(results: List[dict]):
-    """Create a zip file with all device outputs as separate .txt files"""
+    """
+    Create a zip file with all device outputs as separate .txt files.
+    Deprecated: GET /batch/jobs/{job_id}/archive streams the stored outputs instead.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     zip_filename = f"batch_results_{timestamp}.zip"
     zip_path = f"/tmp/{zip_filename}"
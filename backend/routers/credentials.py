@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from backend.dependencies import get_data_manager
 from backend.modules.data_manager import DataManager
 from pydantic import BaseModel
 from typing import Optional
@@ -8,8 +9,6 @@ router = APIRouter(
     tags=["credentials"]
 )
 
-data_manager = DataManager()
-
 class Credential(BaseModel):
     name: str
     username: str
@@ -17,11 +16,11 @@ class Credential(BaseModel):
     secret: Optional[str] = ""
 
 @router.get("")
-async def get_credentials():
+async def get_credentials(data_manager: DataManager = Depends(get_data_manager)):
     return data_manager.credentials
 
 @router.post("")
-async def add_credential(credential: Credential):
+async def add_credential(credential: Credential, data_manager: DataManager = Depends(get_data_manager)):
     data_manager.save_credential(
         credential.name,
         credential.username,
@@ -31,7 +30,7 @@ async def add_credential(credential: Credential):
     return {"message": f"Credential {credential.name} added successfully", "credential": credential}
 
 @router.delete("/{name}")
-async def delete_credential(name: str):
+async def delete_credential(name: str, data_manager: DataManager = Depends(get_data_manager)):
     if name in data_manager.credentials:
         data_manager.delete_credential(name)
         return {"message": f"Credential {name} deleted"}
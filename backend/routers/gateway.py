@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException
-from backend.modules.ssh_manager import GatewaySession
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException
+from backend.dependencies import get_data_manager
+from backend.modules.data_manager import DataManager
+from backend.modules.ssh_manager import GatewaySession, GATEWAY_TRANSPORTS, gateway_registry
+from backend.modules.session_pool import session_pool
+from pydantic import BaseModel, Field
 from typing import Optional
 
 router = APIRouter(
@@ -9,20 +12,19 @@ router = APIRouter(
 )
 
 # Global gateway session (in a real app, this would be user-specific)
+# Devices with their own jump host profile use gateway_registry instead.
 gateway_session: Optional[GatewaySession] = None
 
 class GatewayConnect(BaseModel):
     jumphost1_profile: str
     jumphost2_profile: Optional[str] = None
+    transports: int = Field(default=GATEWAY_TRANSPORTS, ge=1, le=16)
 
 @router.post("/connect")
-async def connect_gateway(connection: GatewayConnect):
+async def connect_gateway(connection: GatewayConnect, data_manager: DataManager = Depends(get_data_manager)):
     """Establish a gateway session through jump hosts"""
     global gateway_session
     
-    from backend.modules.data_manager import DataManager
-    data_manager = DataManager()
-    
     # Get jumphost1 config
     if connection.jumphost1_profile not in data_manager.jumphosts:
         raise HTTPException(status_code=404, detail=f"Jump host '{connection.jumphost1_profile}' not found")
@@ -55,13 +57,17 @@ async def connect_gateway(connection: GatewayConnect):
             gw_config['port'],
             gw_config['username'],
             gw_config['password'],
-            jumphost2_config=jh2_config
+            jumphost2_config=jh2_config,
+            transports=connection.transports
         )
+        # Share the session with devices whose jump host chain matches
+        gateway_registry.register(connection.jumphost1_profile, connection.jumphost2_profile, gateway_session)
         
         return {
             "status": "connected",
             "jumphost1": connection.jumphost1_profile,
-            "jumphost2": connection.jumphost2_profile
+            "jumphost2": connection.jumphost2_profile,
+            "transports": connection.transports
         }
     except Exception as e:
         gateway_session = None
@@ -75,13 +81,33 @@ async def get_gateway_status():
     if gateway_session and gateway_session.is_active():
         return {
             "connected": True,
-            "status": "active"
+            "status": "active",
+            "channel_limit": gateway_session.limiter.get_stats(),
+            "transports": gateway_session.get_transport_stats(),
+            "chains": gateway_registry.list_chains()
         }
     return {
         "connected": False,
-        "status": "disconnected"
+        "status": "disconnected",
+        "chains": gateway_registry.list_chains()
     }
 
+@router.get("/chains")
+async def get_gateway_chains():
+    """List the gateway sessions opened per jump host chain"""
+    return gateway_registry.list_chains()
+
+@router.get("/chains/stats")
+async def get_gateway_chain_stats():
+    """Get login/reuse counters of the per-chain gateway cache"""
+    return gateway_registry.get_stats()
+
+@router.delete("/chains/{jumphost1_profile}")
+async def close_gateway_chain(jumphost1_profile: str, jumphost2_profile: Optional[str] = None):
+    """Close the shared gateway session of one jump host chain"""
+    gateway_registry.close(jumphost1_profile, jumphost2_profile)
+    return {"status": "closed"}
+
 @router.post("/disconnect")
 async def disconnect_gateway():
     """Disconnect the gateway session"""
@@ -91,6 +117,8 @@ async def disconnect_gateway():
         try:
             gateway_session.close()
             gateway_session = None
+            # Pooled device sessions ride on the gateway transport
+            session_pool.close_all()
             return {"status": "disconnected"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to disconnect: {str(e)}")
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from backend.dependencies import get_data_manager
 from backend.modules.data_manager import DataManager
 from pydantic import BaseModel
 from typing import List, Optional, Dict
@@ -8,8 +9,6 @@ router = APIRouter(
     tags=["inventory"]
 )
 
-data_manager = DataManager()
-
 class Device(BaseModel):
     name: str
     host: str
@@ -24,11 +23,28 @@ class Device(BaseModel):
     tags: List[str] = []
 
 @router.get("/devices")
-async def get_devices():
-    return data_manager.inventory
+async def get_devices(data_manager: DataManager = Depends(get_data_manager)):
+    return data_manager.get_all_devices()
+
+@router.get("/tags")
+async def get_tags(data_manager: DataManager = Depends(get_data_manager)):
+    """Every tag in use with its number of devices"""
+    return data_manager.get_tag_counts()
+
+@router.get("/query")
+async def query_devices(q: str, data_manager: DataManager = Depends(get_data_manager)):
+    """
+    Devices matching a tag expression, e.g. q=core AND (dc1 OR dc2) AND NOT lab.
+    Answered from the inverted tag index; quote tags containing spaces or parentheses.
+    """
+    try:
+        names = data_manager.query_devices(q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid tag expression: {str(e)}")
+    return {"expression": q, "count": len(names), "devices": names}
 
 @router.post("/devices")
-async def add_device(device: Device):
+async def add_device(device: Device, data_manager: DataManager = Depends(get_data_manager)):
     # Convert Pydantic model to dict
     device_data = device.dict()
     name = device_data.pop('name')
@@ -47,7 +63,7 @@ async def add_device(device: Device):
     return {"message": f"Device {name} added successfully", "device": device}
 
 @router.put("/devices/{name}")
-async def update_device(name: str, device: Device):
+async def update_device(name: str, device: Device, data_manager: DataManager = Depends(get_data_manager)):
     """Update an existing device"""
     if name not in data_manager.inventory:
         raise HTTPException(status_code=404, detail="Device not found")
@@ -70,7 +86,7 @@ async def update_device(name: str, device: Device):
     return {"message": f"Device {name} updated successfully", "device": device}
 
 @router.delete("/devices/{name}")
-async def delete_device(name: str):
+async def delete_device(name: str, data_manager: DataManager = Depends(get_data_manager)):
     if name in data_manager.inventory:
         data_manager.delete_device(name)
         return {"message": f"Device {name} deleted"}
@@ -80,22 +96,38 @@ from fastapi.responses import StreamingResponse
 from fastapi import UploadFile, File
 import csv
 import io
+import itertools
+import json
 
-@router.get("/export/csv")
-async def export_inventory_csv():
-    """Export inventory to CSV file"""
+# CSV rows parsed and validated per step of an import
+IMPORT_CHUNK_SIZE = 1000
+
+EXPORT_COLUMNS = [
+    'name', 'host', 'device_type', 'port',
+    'credential_name', 'jumphost_profile', 'jumphost2_profile', 'tags'
+]
+# Devices serialized per chunk of an export response
+EXPORT_CHUNK_SIZE = 500
+
+def _export_filters(tag, device_type, jumphost_profile):
+    filters = {"tag": tag, "device_type": device_type, "jumphost_profile": jumphost_profile}
+    return {key: value for key, value in filters.items() if value}
+
+def _iter_chunks(devices, serialize):
+    """Joins serialized devices into chunks of EXPORT_CHUNK_SIZE for the response body."""
+    while True:
+        chunk = list(itertools.islice(devices, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield "".join(serialize(name, device) for name, device in chunk)
+
+def _iter_csv(devices):
     output = io.StringIO()
     writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow([
-        'name', 'host', 'device_type', 'port', 
-        'credential_name', 'jumphost_profile', 'jumphost2_profile', 'tags'
-    ])
-    
-    # Write device data
-    for name, device in data_manager.inventory.items():
-        tags_str = ','.join(device.get('tags', []))
+
+    def serialize(name, device):
+        output.seek(0)
+        output.truncate()
         writer.writerow([
             name,
             device.get('host', ''),
@@ -104,56 +136,122 @@ async def export_inventory_csv():
             device.get('credential_name', ''),
             device.get('jumphost_profile', ''),
             device.get('jumphost2_profile', ''),
-            tags_str
+            ','.join(device.get('tags', []))
         ])
-    
-    output.seek(0)
+        return output.getvalue()
+
+    yield ",".join(EXPORT_COLUMNS) + "\r\n"
+    yield from _iter_chunks(devices, serialize)
+
+def _iter_ndjson(devices):
+    def serialize(name, device):
+        return json.dumps({"name": name, **device}) + "\n"
+
+    yield from _iter_chunks(devices, serialize)
+
+@router.get("/export/csv")
+async def export_inventory_csv(tag: Optional[str] = None, device_type: Optional[str] = None,
+                               jumphost_profile: Optional[str] = None,
+                               data_manager: DataManager = Depends(get_data_manager)):
+    """
+    Export inventory to CSV file.
+    Rows are streamed from the store as they are serialized; tag, device_type
+    and jumphost_profile restrict the export to matching devices.
+    """
+    devices = data_manager.iter_devices(**_export_filters(tag, device_type, jumphost_profile))
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _iter_csv(devices),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=inventory_export.csv"}
     )
 
+@router.get("/export/ndjson")
+async def export_inventory_ndjson(tag: Optional[str] = None, device_type: Optional[str] = None,
+                                  jumphost_profile: Optional[str] = None,
+                                  data_manager: DataManager = Depends(get_data_manager)):
+    """Export inventory as newline-delimited JSON, one device per line, with the CSV export's filters."""
+    devices = data_manager.iter_devices(**_export_filters(tag, device_type, jumphost_profile))
+    return StreamingResponse(
+        _iter_ndjson(devices),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=inventory_export.ndjson"}
+    )
+
+def _read_csv_rows(stream):
+    """Yields (line number, row) from a CSV stream, numbering rows by the line they start on."""
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'name' not in [field.strip() for field in reader.fieldnames]:
+        raise HTTPException(status_code=400, detail="CSV header must include a 'name' column")
+    for row in reader:
+        # line_num is where the row ends; quoted fields may span several lines
+        embedded = sum(value.count('\n') for value in row.values() if isinstance(value, str))
+        yield reader.line_num - embedded, row
+
+def _validate_device_row(row):
+    """Returns (name, device) for a CSV row, or raises ValueError explaining what is wrong."""
+    row = {(key or '').strip(): (value or '').strip() if isinstance(value, str) else '' for key, value in row.items()}
+    name = row.get('name', '')
+    host = row.get('host', '')
+    if not host:
+        raise ValueError("host is required")
+    port = row.get('port') or '22'
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"port '{port}' is not a number")
+    if not 0 < port < 65536:
+        raise ValueError(f"port {port} is out of range")
+    return name, {
+        "device_type": row.get('device_type') or 'cisco_nxos',
+        "host": host,
+        "port": port,
+        "credential_name": row.get('credential_name', ''),
+        "jumphost_profile": row.get('jumphost_profile') or None,
+        "jumphost2_profile": row.get('jumphost2_profile') or None,
+        "tags": [t.strip() for t in row.get('tags', '').split(',') if t.strip()]
+    }
+
 @router.post("/import/csv")
-async def import_inventory_csv(file: UploadFile = File(...)):
-    """Import devices from CSV file"""
+def import_inventory_csv(file: UploadFile = File(...), data_manager: DataManager = Depends(get_data_manager)):
+    """
+    Import devices from CSV file.
+    The upload is parsed as a stream and validated in chunks of IMPORT_CHUNK_SIZE
+    rows; valid rows are then saved together in one store write. Rows that fail
+    validation are skipped and reported with their line number.
+    """
+    devices = {}
+    errors = []
+    stream = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
     try:
-        contents = await file.read()
-        decoded = contents.decode('utf-8')
-        csv_reader = csv.DictReader(io.StringIO(decoded))
-        
-        imported_count = 0
-        errors = []
-        
-        for row in csv_reader:
-            try:
-                name = row.get('name', '').strip()
-                if not name:
+        rows = _read_csv_rows(stream)
+        while True:
+            chunk = list(itertools.islice(rows, IMPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            for line, row in chunk:
+                if not (row.get('name') or '').strip():
+                    continue
+                try:
+                    name, device = _validate_device_row(row)
+                except ValueError as e:
+                    errors.append({"line": line, "device": row['name'].strip(), "error": str(e)})
                     continue
-                
-                # Parse tags
-                tags_str = row.get('tags', '').strip()
-                tags = [t.strip() for t in tags_str.split(',') if t.strip()]
-                
-                # Save device
-                data_manager.save_device(
-                    name,
-                    row.get('device_type', 'cisco_nxos').strip(),
-                    row.get('host', '').strip(),
-                    int(row.get('port', 22)),
-                    row.get('credential_name', '').strip(),
-                    row.get('jumphost_profile', '').strip() or None,
-                    row.get('jumphost2_profile', '').strip() or None,
-                    tags
-                )
-                imported_count += 1
-            except Exception as e:
-                errors.append(f"Row {imported_count + 1}: {str(e)}")
-        
-        return {
-            "message": f"Imported {imported_count} device(s)",
-            "imported": imported_count,
-            "errors": errors
-        }
+                devices[name] = device
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse CSV: {str(e)}")
+    finally:
+        stream.detach()
+
+    try:
+        data_manager.save_devices(devices)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to import CSV: {str(e)}")
+
+    message = f"Imported {len(devices)} device(s)"
+    if errors:
+        message += f", {len(errors)} row(s) rejected"
+    return {
+        "message": message,
+        "imported": len(devices),
+        "errors": errors
+    }
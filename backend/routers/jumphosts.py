@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from backend.dependencies import get_data_manager
 from backend.modules.data_manager import DataManager
 from pydantic import BaseModel
 from typing import Optional
@@ -8,8 +9,6 @@ router = APIRouter(
     tags=["jumphosts"]
 )
 
-data_manager = DataManager()
-
 class JumpHost(BaseModel):
     name: str
     host: str
@@ -18,11 +17,11 @@ class JumpHost(BaseModel):
     port: int = 22
 
 @router.get("")
-async def get_jumphosts():
+async def get_jumphosts(data_manager: DataManager = Depends(get_data_manager)):
     return data_manager.jumphosts
 
 @router.post("")
-async def add_jumphost(jumphost: JumpHost):
+async def add_jumphost(jumphost: JumpHost, data_manager: DataManager = Depends(get_data_manager)):
     data_manager.save_jumphost(
         jumphost.name,
         jumphost.host,
@@ -33,7 +32,7 @@ async def add_jumphost(jumphost: JumpHost):
     return {"message": f"Jump host {jumphost.name} added successfully", "jumphost": jumphost}
 
 @router.delete("/{name}")
-async def delete_jumphost(name: str):
+async def delete_jumphost(name: str, data_manager: DataManager = Depends(get_data_manager)):
     if name in data_manager.jumphosts:
         data_manager.delete_jumphost(name)
         return {"message": f"Jump host {name} deleted"}
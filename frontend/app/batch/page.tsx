@@ -33,16 +33,23 @@ export default function BatchPage() {
   const [selectedDevices, setSelectedDevices] = useState<string[]>([])
   const [command, setCommand] = useState("")
   const [results, setResults] = useState<BatchResult[]>([])
+  const [jobId, setJobId] = useState<string | null>(null)
   const [progress, setProgress] = useState<DeviceProgress[]>([])
   const [loading, setLoading] = useState(false)
   const [message, setMessage] = useState("")
   const [progressPercent, setProgressPercent] = useState(0)
+  const [allTags, setAllTags] = useState<string[]>([])
+  const [tagExpression, setTagExpression] = useState("")
 
   useEffect(() => {
     fetch('http://localhost:8000/inventory/devices')
       .then(res => res.json())
       .then(data => setDevices(data))
       .catch(err => console.error('Failed to fetch devices:', err))
+    fetch('http://localhost:8000/inventory/tags')
+      .then(res => res.json())
+      .then(data => setAllTags(Object.keys(data)))
+      .catch(err => console.error('Failed to fetch tags:', err))
   }, [])
 
   const toggleDevice = (deviceName: string) => {
@@ -61,19 +68,26 @@ export default function BatchPage() {
     setSelectedDevices([])
   }
 
-  const selectByTag = (tag: string) => {
-    const devicesWithTag = Object.entries(devices)
-      .filter(([_, device]) => device.tags?.includes(tag))
-      .map(([name, _]) => name)
-    setSelectedDevices(devicesWithTag)
+  // Select the devices matching a tag expression, e.g. core AND (dc1 OR dc2) AND NOT lab
+  const selectByQuery = async (expression: string) => {
+    try {
+      const res = await fetch(`http://localhost:8000/inventory/query?q=${encodeURIComponent(expression)}`)
+      const data = await res.json()
+      if (res.ok) {
+        setSelectedDevices(data.devices)
+      } else {
+        setMessage(data.detail || "Invalid tag expression")
+        setTimeout(() => setMessage(""), 3000)
+      }
+    } catch (err) {
+      console.error('Tag query failed:', err)
+    }
   }
 
-  // Get all unique tags from all devices
-  const allTags = Array.from(
-    new Set(
-      Object.values(devices).flatMap((device: any) => device.tags || [])
-    )
-  )
+  const selectByTag = (tag: string) => {
+    // Quote the tag so spaces or operator names are taken literally
+    selectByQuery(`"${tag.replace(/\\/g, '\\\\').replace(/"/g, '\\"')}"`)
+  }
 
   const handleExecute = async () => {
     if (selectedDevices.length === 0) {
@@ -89,6 +103,7 @@ export default function BatchPage() {
 
     setLoading(true)
     setResults([])
+    setJobId(null)
     setProgressPercent(0)
     
     // Initialize progress tracking
@@ -111,6 +126,7 @@ export default function BatchPage() {
       if (res.ok) {
         const data = await res.json()
         setResults(data)
+        setJobId(res.headers.get('X-Job-Id'))
         setProgressPercent(100)
         setMessage(`Executed on ${selectedDevices.length} device(s)`)
         
@@ -134,26 +150,16 @@ export default function BatchPage() {
   }
 
   const handleDownload = async () => {
-    if (results.length === 0) return
+    if (results.length === 0 || !jobId) return
 
     try {
-      const res = await fetch('http://localhost:8000/batch/download', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(results)
-      })
-
-      if (res.ok) {
-        const blob = await res.blob()
-        const url = window.URL.createObjectURL(blob)
-        const a = document.createElement('a')
-        a.href = url
-        a.download = `batch_results_${Date.now()}.zip`
-        document.body.appendChild(a)
-        a.click()
-        window.URL.revokeObjectURL(url)
-        document.body.removeChild(a)
-      }
+      // The server streams the archive from its stored outputs; nothing is uploaded
+      const a = document.createElement('a')
+      a.href = `http://localhost:8000/batch/jobs/${jobId}/archive`
+      a.download = `batch_results_${jobId}.zip`
+      document.body.appendChild(a)
+      a.click()
+      document.body.removeChild(a)
     } catch (err) {
       console.error('Download failed:', err)
       setMessage("Download failed")
@@ -209,6 +215,24 @@ export default function BatchPage() {
                 </>
               )}
             </div>
+            <div className="flex gap-2">
+              <Input
+                placeholder="Tag expression, e.g. core AND (dc1 OR dc2) AND NOT lab"
+                value={tagExpression}
+                onChange={(e) => setTagExpression(e.target.value)}
+                onKeyDown={(e) => {
+                  if (e.key === 'Enter' && tagExpression.trim()) selectByQuery(tagExpression)
+                }}
+              />
+              <Button
+                size="sm"
+                variant="outline"
+                onClick={() => selectByQuery(tagExpression)}
+                disabled={!tagExpression.trim()}
+              >
+                Select
+              </Button>
+            </div>
             <Separator />
             <div className="space-y-2 max-h-[400px] overflow-y-auto">
               {Object.entries(devices).map(([name, device]) => (
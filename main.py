@@ -1,9 +1,10 @@
 import streamlit as st
-import os
 from datetime import datetime
 from modules.ssh_manager import SSHTunnelManager, GatewaySession
 from modules.device_manager import DeviceConnection
 from modules.data_manager import DataManager
+from modules.result_store import result_store
+from modules.retention import RetentionEngine
 from modules.ui_components import render_home_page, render_inventory_page, render_jumphosts_page, render_dashboard_content, render_gateway_sidebar
 from modules.styles import load_css
 
@@ -21,6 +22,15 @@ if 'logs' not in st.session_state:
 if 'connected_device' not in st.session_state:
     st.session_state['connected_device'] = None
 
+@st.cache_resource
+def start_retention():
+    """Starts one background retention thread per process (not per browser session)."""
+    engine = RetentionEngine(result_store)
+    engine.start()
+    return engine
+
+start_retention()
+
 def log(message):
     st.session_state['logs'].append(message)
 
@@ -183,19 +193,13 @@ def main():
                     
                     output = st.session_state['device_manager'].send_command(command_to_execute)
                     
-                    # Generate Filename
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    safe_command = "".join([c if c.isalnum() else "_" for c in command_to_execute])
+                    # Save to the result store (one job per day of interactive commands)
                     device_name = st.session_state.get('connected_device', 'unknown_device')
-                    filename = f"{device_name}_{safe_command}_{timestamp}.txt"
-                    filepath = os.path.join("downloads", filename)
-                    
-                    # Save to file
-                    with open(filepath, "w") as f:
-                        f.write(output)
+                    job_id = f"interactive_{datetime.now().strftime('%Y%m%d')}"
+                    entry = result_store.put(job_id, device_name, command_to_execute, output)
                     
-                    st.session_state['last_generated_file'] = filepath
-                    log(f"Command executed. Output saved to {filename}")
+                    st.session_state['last_generated_file'] = entry
+                    log(f"Command executed. Output saved to {result_store.archive_name(entry)}")
                     status_placeholder.success("Command executed. Output saved.")
                     
                     # Force Rerun to update UI immediately
@@ -1,8 +1,11 @@
 import concurrent.futures
-import os
-from datetime import datetime
-from modules.ssh_manager import SSHTunnelManager
-from modules.device_manager import DeviceConnection
+import time
+import uuid
+from modules.ssh_manager import gateway_registry
+from modules.device_manager import DeviceConnection, StageTimer, combine_outputs
+from modules.retry_policy import RetryBudget, RetryState, classify_error
+from modules.result_store import result_store
+from modules.session_pool import session_pool
 
 import streamlit as st
 
@@ -13,139 +16,206 @@ class BatchProcessor:
     def __init__(self, data_manager):
         self.data_manager = data_manager
 
-    def process_single_device(self, device_name, device_config, command, gateway_session=None):
+    def process_single_device(self, device_name, device_config, commands, gateway_session=None, retry_budget=None, job_id=None):
         """
-        Connects to a single device, executes the command, and saves the output.
+        Connects to a single device, executes the commands in order over one session,
+        and saves each successful output to the result store under job_id
+        (index entries in result["stored"]).
         Designed to be run in a separate thread.
+        Devices go through the active gateway session or, without one, through the
+        cached session of their own jump host chain, which is shared by every device
+        behind the same bastions instead of a new tunnel per device.
+        Sessions opened through a gateway are kept warm in the session pool, and the
+        session profile learned on the first login shortens later session preparation.
+        The seconds spent in each stage are returned in result["timings"].
+        Transient connection failures (throttled channels, timeouts, dropped sessions)
+        are retried with jittered backoff; bad credentials and unknown hosts are not.
+        result["attempts"] counts the connection attempts and a failed device carries
+        its result["error_class"].
+
+        Args:
+            commands (list | str): Ordered list of commands (a single command string is accepted).
+            retry_budget (RetryBudget): Retries shared by the whole batch (None means unlimited).
+            job_id (str): Result store key of the batch (a new one if not given).
         """
-        ssh_manager = SSHTunnelManager()
-        device_manager = DeviceConnection()
+        if isinstance(commands, str):
+            commands = [commands]
+        job_id = job_id or uuid.uuid4().hex
+        device_manager = None
+        pooled = False
+        signature = None
+        chain = None
+        timer = StageTimer()
+        retry = RetryState(retry_budget)
+        start = time.monotonic()
         result = {
             "device": device_name,
             "status": "pending",
             "output": "",
-            "file": None,
-            "error": None
+            "commands": [],
+            "stored": [],
+            "timings": timer.timings,
+            "attempts": 1,
+            "error": None,
+            "error_class": None
         }
 
         try:
-            # 1. Setup Tunnel (if needed)
-            tunnel_port = None
-            sock = None
-            
+            # Load Credentials
+            creds = self.data_manager.get_credential(device_config['credential_name'])
+            if not creds:
+                raise Exception(f"Credential '{device_config['credential_name']}' not found.")
+
+            def connect(sock=None):
+                connection = DeviceConnection()
+                try:
+                    success = connection.connect(
+                        device_config['device_type'],
+                        device_config['host'],
+                        creds['username'],
+                        creds['password'],
+                        port=device_config['port'],
+                        secret=creds.get('secret'),
+                        sock=sock,
+                        profile=self.data_manager.get_session_profile(device_name)
+                    )
+                finally:
+                    timer.timings.update(connection.timings)
+                if not success:
+                    raise Exception("Connection failed (unknown reason).")
+                if connection.learned_profile:
+                    # Later logins replay this instead of rediscovering the session
+                    self.data_manager.save_session_profile(device_name, connection.learned_profile)
+                return connection
+
+            # 1. Pick the Gateway
+            route = None
             if gateway_session and gateway_session.is_active():
                 # Use Shared Gateway Session
-                try:
-                    sock = gateway_session.open_channel(device_config['host'], device_config['port'])
-                except Exception as e:
-                    raise Exception(f"Failed to open channel via gateway: {e}")
-            
+                route = gateway_session
             elif device_config.get('jumphost_profile'):
-                # Legacy: Create new tunnel
-                # Load Jump Host Config
-                jumphost = self.data_manager.get_jumphost(device_config['jumphost_profile'])
-                if not jumphost:
-                    raise Exception(f"Jump host profile '{device_config['jumphost_profile']}' not found.")
-                
-                # Load Second Jump Host (if any)
-                bastion2_conf = None
-                if device_config.get('jumphost2_profile'):
-                    bastion2_conf = self.data_manager.get_jumphost(device_config['jumphost2_profile'])
-
-                tunnel_port = ssh_manager.start_tunnel(
-                    jumphost['host'],
-                    jumphost['port'],
-                    jumphost['username'],
-                    jumphost['password'],
+                # Cached, reference-counted session of the device's jump host chain
+                chain = (device_config['jumphost_profile'], device_config.get('jumphost2_profile'))
+                with timer.stage("gateway"):
+                    route = gateway_registry.acquire(self.data_manager, *chain)
+
+            # 2. Connect to Device, reusing a warm device session if possible
+            if route:
+                def connect_via_gateway():
+                    try:
+                        with timer.stage("channel_open"):
+                            sock = route.open_channel(device_config['host'], device_config['port'])
+                    except Exception as e:
+                        raise Exception(f"Failed to open channel via gateway: {e}")
+                    try:
+                        return connect(sock=sock)
+                    except Exception:
+                        sock.close()
+                        raise
+
+                signature = (
                     device_config['host'],
                     device_config['port'],
-                    bastion2_config=bastion2_conf
+                    device_config['device_type'],
+                    creds['username'],
+                    id(route)
                 )
+                device_manager = retry.run(lambda: session_pool.acquire(device_name, signature, connect_via_gateway))
+                pooled = True
 
-            # 2. Connect to Device
-            # Load Credentials
-            creds = self.data_manager.get_credential(device_config['credential_name'])
-            if not creds:
-                raise Exception(f"Credential '{device_config['credential_name']}' not found.")
+            else:
+                device_manager = retry.run(connect)
+
+            # 3. Execute Commands
+            with timer.stage("commands"):
+                command_results = device_manager.send_commands(commands)
+            result['commands'] = command_results
+            result['output'] = combine_outputs(command_results)
 
-            success = device_manager.connect(
-                device_config['device_type'],
-                device_config['host'],
-                creds['username'],
-                creds['password'],
-                port=device_config['port'],
-                secret=creds.get('secret'),
-                use_tunnel=bool(tunnel_port),
-                tunnel_port=tunnel_port,
-                sock=sock
-            )
-
-            if not success:
-                raise Exception("Connection failed (unknown reason).")
-
-            # 3. Execute Command
-            output = device_manager.send_command(command)
-            result['output'] = output
+            # 4. Save each output to the result store (compressed, deduplicated)
+            with timer.stage("save"):
+                for command_result in command_results:
+                    if command_result['status'] != "success":
+                        continue
+                    result['stored'].append(result_store.put(
+                        job_id, device_name, command_result['command'], command_result['output']
+                    ))
+
+            # Commands after the first failure or timeout come back as "skipped"
+            failed = [r for r in command_results if r['status'] not in ("success", "skipped")]
+            if failed:
+                raise Exception(f"Command '{failed[0]['command']}' failed: {failed[0]['output']}")
             result['status'] = "success"
 
-            # 4. Save to File
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_command = "".join([c if c.isalnum() else "_" for c in command])
-            filename = f"{device_name}_{safe_command}_{timestamp}.txt"
-            filepath = os.path.join("downloads", filename)
-            
-            with open(filepath, "w") as f:
-                f.write(output)
-            result['file'] = filepath
+            if pooled:
+                session_pool.release(device_name, signature, device_manager)
+                device_manager = None
 
         except Exception as e:
             result['status'] = "failed"
             result['error'] = str(e)
+            result['error_class'] = classify_error(e)
+            if pooled and device_manager:
+                # Unread output may still be on the channel; never hand it to the next batch
+                timer.timings.update(device_manager.timings)
+                session_pool.discard(device_manager)
+                device_manager = None
         
         finally:
-            # 5. Cleanup
-            try:
-                device_manager.disconnect()
-            except:
-                pass
+            # 5. Cleanup (sessions returned to the pool stay open)
             try:
-                ssh_manager.stop_tunnel()
+                if device_manager:
+                    device_manager.disconnect()
+                    timer.timings.update(device_manager.timings)
             except:
                 pass
-            # Note: We do NOT close the gateway_session here as it is shared.
+            if chain:
+                gateway_registry.release(*chain)
+            # Note: We do NOT close the gateway sessions here as they are shared.
             # The channel (sock) is closed by Netmiko disconnect or GC.
+            timer.timings["total"] = round(time.monotonic() - start, 4)
+            result['attempts'] = max(retry.attempts, 1)
 
         return result
 
-    def execute_batch(self, device_names, command):
+    def iter_batch(self, device_names, commands, gateway_session=None, job_id=None):
         """
-        Executes the command on all specified devices in parallel.
+        Executes the commands on all specified devices in parallel and yields
+        each result as soon as its device finishes.
+        Outputs are stored in the result store under job_id (a new one if not given).
         """
-        results = []
-        
+        job_id = job_id or uuid.uuid4().hex
         # Check for active gateway session in main thread
-        gateway_session = None
-        if 'gateway_session' in st.session_state and st.session_state['gateway_session']:
+        if gateway_session is None and st.session_state.get('gateway_session'):
             gateway_session = st.session_state['gateway_session']
 
-        # Increased max_workers back to 10 since we are multiplexing (if using gateway)
-        # or if not using gateway, we rely on the user to be careful.
-        # Actually, let's keep it at 5 to be safe even with multiplexing.
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_device = {}
+        # Channel opens are paced by each gateway's adaptive limiter and jump host
+        # logins are shared per chain, so more workers only queue at the bastion.
+        max_workers = 20
+        retry_budget = RetryBudget()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
             for name in device_names:
                 device_config = self.data_manager.get_device(name)
                 if device_config:
-                    future = executor.submit(self.process_single_device, name, device_config, command, gateway_session)
-                    future_to_device[future] = name
+                    futures.append(executor.submit(self.process_single_device, name, device_config, commands, gateway_session, retry_budget, job_id))
                 else:
-                    results.append({
+                    yield {
                         "device": name,
                         "status": "failed",
-                        "error": "Device config not found"
-                    })
+                        "output": "",
+                        "commands": [],
+                        "stored": [],
+                        "attempts": 0,
+                        "error": "Device config not found",
+                        "error_class": None
+                    }
 
-            for future in concurrent.futures.as_completed(future_to_device):
-                results.append(future.result())
-        
-        return results
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+
+    def execute_batch(self, device_names, commands, gateway_session=None, job_id=None):
+        """
+        Executes the commands on all specified devices in parallel.
+        """
+        return list(self.iter_batch(device_names, commands, gateway_session, job_id))
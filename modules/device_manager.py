@@ -1,14 +1,36 @@
-from netmiko import ConnectHandler
+from contextlib import contextmanager
+from datetime import datetime
+from netmiko import ConnectHandler, SSHDetect
+from netmiko.exceptions import ReadTimeout
+import math
+import re
 import time
 
+# Session preparation commands (terminal width, paging) of the platforms whose
+# preparation can be replayed from a learned session profile
+SESSION_PREP_COMMANDS = {
+    "cisco_ios": ("terminal width 511", "terminal length 0"),
+    "cisco_xe": ("terminal width 511", "terminal length 0"),
+    "cisco_nxos": ("terminal width 511", "terminal length 0"),
+    "arista_eos": ("terminal width 511", "terminal length 0"),
+}
+
+# Error replies of the supported CLIs to a command they do not accept
+REJECTED_COMMAND_PATTERN = re.compile(r"%\s*(Invalid|Incomplete|Ambiguous|Unrecognized|Unknown)", re.IGNORECASE)
+
 class DeviceConnection:
     """
     Manages Netmiko connections to network devices.
     """
     def __init__(self):
         self.connection = None
+        self.sock = None
+        # Stage durations (seconds) of the last connect/disconnect
+        self.timings = {}
+        # Session profile learned by the last connect (None if the given one was used as is)
+        self.learned_profile = None
 
-    def connect(self, device_type, host, username, password, port=22, secret=None, use_tunnel=False, tunnel_port=None, sock=None):
+    def connect(self, device_type, host, username, password, port=22, secret=None, use_tunnel=False, tunnel_port=None, sock=None, timeout=None, profile=None):
         """
         Establishes a connection to the network device.
         
@@ -22,6 +44,10 @@ class DeviceConnection:
             use_tunnel (bool): Whether to use an SSH tunnel.
             tunnel_port (int): Local port of the SSH tunnel (required if use_tunnel is True).
             sock (socket): Optional existing socket/channel (for GatewaySession).
+            timeout (float): Optional limit (seconds) for the TCP connect, SSH banner and authentication.
+            profile (dict): Session profile learned on an earlier login (see learn_session_profile).
+                Session preparation is replayed from it and only falls back to Netmiko's
+                full discovery if the device does not answer as recorded.
             
         Returns:
             bool: True if connection successful, False otherwise.
@@ -37,6 +63,11 @@ class DeviceConnection:
         if secret:
             device_params['secret'] = secret
 
+        if timeout:
+            device_params['conn_timeout'] = timeout
+            device_params['banner_timeout'] = timeout
+            device_params['auth_timeout'] = timeout
+
         if sock:
             device_params['sock'] = sock
             # When using a socket, host/port are technically unused by Netmiko for connection,
@@ -47,19 +78,79 @@ class DeviceConnection:
             device_params['host'] = '127.0.0.1'
             device_params['port'] = tunnel_port
         
+        timer = StageTimer()
+        connection = None
         try:
-            self.connection = ConnectHandler(**device_params)
+            connection = ConnectHandler(**device_params, auto_connect=False)
+            # Same steps as Netmiko's own connect, timed separately
+            with timer.stage("ssh_connect"):
+                # SSH handshake and authentication
+                connection._modify_connection_params()
+                connection.establish_connection()
+            with timer.stage("session_prep"):
+                if not (profile and replay_session_preparation(connection, profile)):
+                    # Prompt discovery, terminal width and paging disable
+                    connection._try_session_preparation()
+                    self.learned_profile = learn_session_profile(connection, device_type)
+            if self.learned_profile:
+                self.learned_profile["prep_seconds"] = timer.timings["session_prep"]
+            self.connection = connection
+            self.sock = sock
             return True
         except Exception as e:
             print(f"Connection failed: {e}")
+            if connection:
+                try:
+                    connection.disconnect()
+                except Exception:
+                    pass
             raise e
+        finally:
+            self.timings = timer.timings
 
-    def send_command(self, command):
+    def send_command(self, command, read_timeout=None):
         """Sends a command to the device and returns the output."""
         if not self.connection:
             raise Exception("Not connected to any device.")
+        if read_timeout:
+            return self.connection.send_command(command, read_timeout=read_timeout)
         return self.connection.send_command(command)
 
+    def send_commands(self, commands, read_timeout=None):
+        """
+        Sends an ordered list of commands over this session.
+        Execution stops at the first failing command; the rest are reported as skipped.
+        A command that exceeds read_timeout is reported with status "timeout".
+
+        Returns:
+            list: One dict per command with command, status, output and duration (seconds).
+        """
+        results = []
+        failed = False
+        for command in commands:
+            if failed:
+                results.append({"command": command, "status": "skipped", "output": "", "duration": 0.0})
+                continue
+            start = time.monotonic()
+            try:
+                output = self.send_command(command, read_timeout=read_timeout)
+                status = "success"
+            except ReadTimeout as e:
+                output = str(e)
+                status = "timeout"
+                failed = True
+            except Exception as e:
+                output = str(e)
+                status = "failed"
+                failed = True
+            results.append({
+                "command": command,
+                "status": status,
+                "output": output,
+                "duration": round(time.monotonic() - start, 3)
+            })
+        return results
+
     def send_config_set(self, config_commands):
         """Sends a set of configuration commands."""
         if not self.connection:
@@ -69,8 +160,177 @@ class DeviceConnection:
     def disconnect(self):
         """Disconnects from the device."""
         if self.connection:
-            self.connection.disconnect()
-            self.connection = None
+            start = time.monotonic()
+            try:
+                self.connection.disconnect()
+            finally:
+                self.connection = None
+                self.sock = None
+                self.timings["disconnect"] = round(time.monotonic() - start, 4)
+
+    def abort(self):
+        """
+        Forcibly closes the underlying channel so that a thread blocked on this
+        session fails right away. Safe to call from another thread.
+        """
+        try:
+            if self.sock:
+                self.sock.close()
+            elif self.connection and getattr(self.connection, 'remote_conn_pre', None):
+                self.connection.remote_conn_pre.close()
+        except Exception:
+            pass
 
     def is_connected(self):
         return self.connection is not None
+
+    def is_alive(self):
+        """Checks that the session is still usable (transport up and device responding)."""
+        if not self.connection:
+            return False
+        try:
+            return self.connection.is_alive()
+        except Exception:
+            return False
+
+
+def detect_device_type(host, username, password, port=22, secret=None, sock=None, timeout=None):
+    """
+    Probes a device with Netmiko's SSHDetect and returns the best matching
+    Netmiko device_type, or None if no platform matched.
+
+    Args:
+        sock (socket): Optional existing socket/channel (for GatewaySession).
+        timeout (float): Optional limit (seconds) for the TCP connect, SSH banner and authentication.
+    """
+    params = {
+        'device_type': 'autodetect',
+        'host': host,
+        'username': username,
+        'password': password,
+        'port': port,
+    }
+    if secret:
+        params['secret'] = secret
+    if timeout:
+        params['conn_timeout'] = timeout
+        params['banner_timeout'] = timeout
+        params['auth_timeout'] = timeout
+    if sock:
+        params['sock'] = sock
+
+    guesser = SSHDetect(**params)
+    try:
+        return guesser.autodetect()
+    finally:
+        try:
+            guesser.connection.disconnect()
+        except Exception:
+            pass
+
+def learn_session_profile(connection, device_type):
+    """
+    Records what Netmiko's session preparation found out about a device, so the
+    next login can skip discovery. Returns None for platforms that cannot be replayed.
+    """
+    if device_type not in SESSION_PREP_COMMANDS:
+        return None
+    width_command, paging_command = SESSION_PREP_COMMANDS[device_type]
+    return {
+        "device_type": device_type,
+        "base_prompt": connection.base_prompt,
+        "width_command": width_command,
+        "paging_command": paging_command,
+        "ansi_escape_codes": bool(connection.ansi_escape_codes),
+        "learned_at": datetime.now().isoformat()
+    }
+
+def replay_session_preparation(connection, profile):
+    """
+    Prepares a freshly authenticated session from a learned profile: the width and
+    paging commands are sent back to back after the login prompt, and the recorded
+    prompt is expected after each, instead of probing the channel and discovering
+    the prompt with delays. A command the device rejects counts as a mismatch.
+
+    Returns:
+        bool: False if the device does not match the profile (different platform
+            or prompt); the caller then runs the full session preparation.
+    """
+    if profile.get("device_type") != connection.device_type or not profile.get("base_prompt"):
+        return False
+    commands = [c for c in (profile.get("width_command"), profile.get("paging_command")) if c]
+    if not commands:
+        return False
+    connection.ansi_escape_codes = profile.get("ansi_escape_codes", False)
+    # The device is expected to answer within a few times the preparation time it took before
+    read_timeout = max(2.0, 3 * profile.get("prep_seconds", 0))
+    prompt_pattern = re.escape(profile["base_prompt"]) + r"[>#]"
+    try:
+        # Consume the login prompt first (asking for it like Netmiko's channel test
+        # does), so each read below ends at the prompt that answers its own command
+        try:
+            connection.read_until_pattern(pattern=prompt_pattern, read_timeout=read_timeout)
+        except ReadTimeout:
+            connection.write_channel(connection.RETURN)
+            connection.read_until_pattern(pattern=prompt_pattern, read_timeout=read_timeout)
+        for command in commands:
+            connection.write_channel(connection.normalize_cmd(command))
+        for command in commands:
+            output = connection.read_until_pattern(pattern=prompt_pattern, read_timeout=read_timeout)
+            if REJECTED_COMMAND_PATTERN.search(output):
+                print(f"Session profile mismatch ('{command}' rejected), running full discovery")
+                return False
+    except ReadTimeout:
+        print(f"Session profile mismatch (prompt '{profile['base_prompt']}' not seen), running full discovery")
+        return False
+    connection.base_prompt = profile["base_prompt"]
+    return True
+
+def combine_outputs(command_results):
+    """Joins per-command outputs into one text, with a header per command when there are several."""
+    if len(command_results) == 1:
+        return command_results[0]['output']
+    return "\n\n".join(f"===== {r['command']} =====\n{r['output']}" for r in command_results)
+
+
+class StageTimer:
+    """Records monotonic durations (seconds) of named execution stages."""
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(self.timings.get(name, 0) + time.monotonic() - start, 4)
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize_timings(results):
+    """
+    Aggregates the per-device "timings" of batch results.
+
+    Returns:
+        dict: {stage: {"count", "min", "p50", "p95", "max"}} in seconds.
+    """
+    per_stage = {}
+    for result in results:
+        for stage, duration in (result.get('timings') or {}).items():
+            per_stage.setdefault(stage, []).append(duration)
+
+    summary = {}
+    for stage, durations in per_stage.items():
+        durations.sort()
+        summary[stage] = {
+            "count": len(durations),
+            "min": durations[0],
+            "p50": _percentile(durations, 50),
+            "p95": _percentile(durations, 95),
+            "max": durations[-1]
+        }
+    return summary
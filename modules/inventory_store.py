@@ -0,0 +1,475 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from modules.tag_query import evaluate_tag_query, parse_tag_query
+
+# "json" keeps the inventory in data/inventory.json, "sqlite" in INVENTORY_DB_FILE
+INVENTORY_BACKEND = os.environ.get("INVENTORY_BACKEND", "json")
+INVENTORY_DB_FILE = os.environ.get("INVENTORY_DB_FILE", os.path.join("data", "inventory.db"))
+
+# Device settings besides name and tags, in inventory.json key order
+DEVICE_FIELDS = (
+    "device_type", "host", "port", "credential_name",
+    "jumphost_profile", "jumphost2_profile", "device_type_detected_at"
+)
+
+# Columns find() can filter on; all of them are indexed in SQLite
+FILTER_FIELDS = ("device_type", "jumphost_profile", "credential_name")
+# Devices fetched per query by iter_devices()
+ITER_CHUNK_SIZE = 500
+
+class InventoryStore:
+    """
+    Storage backend of the device inventory used by DataManager.
+    Devices are dicts shaped like the entries of inventory.json.
+    """
+    def get(self, name):
+        """Returns one device, or None."""
+        raise NotImplementedError
+
+    def items(self):
+        """(name, device) pairs of every device, in insertion order."""
+        raise NotImplementedError
+
+    def names(self):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def put(self, name, device):
+        """Adds or replaces one device."""
+        raise NotImplementedError
+
+    def put_many(self, devices):
+        """Adds or replaces every device of a {name: device} dict in one write."""
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def replace(self, inventory):
+        """Replaces the whole inventory with a {name: device} dict."""
+        raise NotImplementedError
+
+    def find(self, tag=None, **filters):
+        """
+        Names of the devices with the given tag and field values,
+        e.g. find(device_type="cisco_ios", jumphost_profile="dc1").
+        """
+        raise NotImplementedError
+
+    def get_many(self, names):
+        """{name: device} for the given names; unknown names are left out."""
+        raise NotImplementedError
+
+    def iter_devices(self, tag=None, chunk_size=ITER_CHUNK_SIZE, **filters):
+        """
+        Yields the (name, device) pairs matching find(tag, **filters), fetching
+        chunk_size devices at a time so the whole inventory is never copied at once.
+        """
+        names = self.find(tag, **filters)
+        for start in range(0, len(names), chunk_size):
+            devices = self.get_many(names[start:start + chunk_size])
+            for name in names[start:start + chunk_size]:
+                if name in devices:
+                    yield name, devices[name]
+
+    def tag_members(self, tag):
+        """Keys of the devices carrying a tag, from the inverted tag index."""
+        raise NotImplementedError
+
+    def all_members(self):
+        """Keys of every device."""
+        raise NotImplementedError
+
+    def names_for(self, keys):
+        """Device names of a set of keys, in inventory order."""
+        raise NotImplementedError
+
+    def tag_counts(self):
+        """{tag: number of devices}, sorted by tag."""
+        raise NotImplementedError
+
+    def query(self, expression):
+        """
+        Names of the devices matching a tag expression such as
+        'core AND (dc1 OR dc2) AND NOT lab' (see tag_query.parse_tag_query),
+        in inventory order. Raises ValueError for a malformed expression.
+        """
+        node = parse_tag_query(expression)
+        return self.names_for(evaluate_tag_query(node, self.tag_members, self.all_members))
+
+    def view(self):
+        """Read-only {name: device} mapping over the store."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+def _check_filters(filters):
+    for field in filters:
+        if field not in FILTER_FIELDS:
+            raise Exception(f"Cannot filter devices by {field}")
+
+class JsonInventoryStore(InventoryStore):
+    """
+    Inventory held as a dict and written back as a whole through save(data)
+    (DataManager's coalesced inventory.json writer). A tag -> names index and
+    each name's position are kept up to date alongside the dict; keys are names.
+    The lock is taken by writers and readers alike, so a query never sees a
+    device half re-indexed by a save from another thread.
+    """
+    def __init__(self, data, save):
+        self.save = save
+        self.lock = threading.RLock()
+        self.load(data)
+
+    def load(self, data):
+        """Replaces the dict (e.g. after inventory.json changed on disk) and rebuilds the indexes."""
+        with self.lock:
+            self.data = data
+            self.tags = {}
+            self.positions = {}
+            # Only ever grows, so a device added after a delete still sorts last
+            self.next_position = 0
+            for name, device in data.items():
+                self._index(name, device)
+
+    def _index(self, name, device):
+        """Sets a device and updates the index by difference: new tags are added before old ones go."""
+        if name not in self.positions:
+            self.positions[name] = self.next_position
+            self.next_position += 1
+        old_tags = set((self.data.get(name) or {}).get("tags") or [])
+        new_tags = set(device.get("tags") or [])
+        self.data[name] = device
+        for tag in new_tags - old_tags:
+            self.tags.setdefault(tag, set()).add(name)
+        self._drop_tags(name, old_tags - new_tags)
+
+    def _drop_tags(self, name, tags):
+        for tag in tags:
+            names = self.tags.get(tag)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.tags[tag]
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def get_many(self, names):
+        with self.lock:
+            return {name: self.data[name] for name in names if name in self.data}
+
+    def items(self):
+        with self.lock:
+            return list(self.data.items())
+
+    def names(self):
+        with self.lock:
+            return list(self.data)
+
+    def count(self):
+        return len(self.data)
+
+    def put(self, name, device):
+        with self.lock:
+            self._index(name, device)
+        self.save(self.data)
+
+    def put_many(self, devices):
+        with self.lock:
+            for name, device in devices.items():
+                self._index(name, device)
+        self.save(self.data)
+
+    def delete(self, name):
+        with self.lock:
+            if name not in self.data:
+                return
+            self._drop_tags(name, self.data[name].get("tags") or [])
+            self.positions.pop(name, None)
+            del self.data[name]
+        self.save(self.data)
+
+    def replace(self, inventory):
+        self.load(inventory)
+        self.save(self.data)
+
+    def find(self, tag=None, **filters):
+        _check_filters(filters)
+        with self.lock:
+            candidates = self.data if tag is None else self.names_for(self.tag_members(tag))
+            return [
+                name for name in candidates
+                if all(self.data[name].get(field) == value for field, value in filters.items())
+            ]
+
+    def query(self, expression):
+        # Evaluate against one consistent state of the index
+        with self.lock:
+            return InventoryStore.query(self, expression)
+
+    def tag_members(self, tag):
+        with self.lock:
+            return set(self.tags.get(tag, ()))
+
+    def all_members(self):
+        with self.lock:
+            return set(self.data)
+
+    def names_for(self, keys):
+        with self.lock:
+            return sorted(keys, key=self.positions.__getitem__)
+
+    def tag_counts(self):
+        with self.lock:
+            return {tag: len(self.tags[tag]) for tag in sorted(self.tags)}
+
+    def view(self):
+        return self.data
+
+class _SqliteView(Mapping):
+    """Mapping interface over SqliteInventoryStore, so inventory[name] and len() keep working."""
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, name):
+        device = self.store.get(name)
+        if device is None:
+            raise KeyError(name)
+        return device
+
+    def __contains__(self, name):
+        return self.store.get(name) is not None
+
+    def __iter__(self):
+        return iter(self.store.names())
+
+    def __len__(self):
+        return self.store.count()
+
+    def items(self):
+        return self.store.items()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    device_type TEXT,
+    host TEXT,
+    port INTEGER,
+    credential_name TEXT,
+    jumphost_profile TEXT,
+    jumphost2_profile TEXT,
+    device_type_detected_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_devices_device_type ON devices (device_type);
+CREATE INDEX IF NOT EXISTS idx_devices_jumphost_profile ON devices (jumphost_profile);
+CREATE INDEX IF NOT EXISTS idx_devices_credential_name ON devices (credential_name);
+CREATE TABLE IF NOT EXISTS device_tags (
+    device_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (device_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_device_tags_tag ON device_tags (tag);
+"""
+
+SCHEMA_VERSION = 1
+
+class SqliteInventoryStore(InventoryStore):
+    """
+    Inventory in a SQLite database: one row per device plus one row per tag,
+    with indexes on device_type, jumphost_profile, credential_name and tag.
+    Saving a device updates only its own rows. device_tags doubles as the
+    inverted tag index; query keys are device ids.
+
+    On first use the database is filled from json_file (the existing
+    inventory.json), which is left in place as a backup.
+    """
+    def __init__(self, path=INVENTORY_DB_FILE, json_file=None):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One connection shared by request handlers and batch workers
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            # WAL lets the Streamlit app and the backend read while the other writes
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self.conn.executescript(SCHEMA)
+        if version < SCHEMA_VERSION:
+            if json_file:
+                migrate_json_inventory(self, json_file)
+            with self.lock:
+                self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _select(self, where="", params=()):
+        """{name: device} for the devices matching a WHERE clause on devices."""
+        columns = ", ".join(DEVICE_FIELDS)
+        rows = self.conn.execute(f"SELECT id, name, {columns} FROM devices {where} ORDER BY id", params).fetchall()
+        devices, by_id = {}, {}
+        for row in rows:
+            device = dict(zip(DEVICE_FIELDS, row[2:]))
+            if device["device_type_detected_at"] is None:
+                del device["device_type_detected_at"]
+            device["tags"] = []
+            devices[row[1]] = by_id[row[0]] = device
+        if where and rows:
+            ids = [row[0] for row in rows]
+            tag_rows = self.conn.execute(
+                f"SELECT device_id, tag FROM device_tags WHERE device_id IN ({', '.join('?' for _ in ids)}) "
+                "ORDER BY device_id, position", ids
+            ).fetchall()
+        elif rows:
+            tag_rows = self.conn.execute("SELECT device_id, tag FROM device_tags ORDER BY device_id, position").fetchall()
+        else:
+            tag_rows = []
+        for device_id, tag in tag_rows:
+            if device_id in by_id:
+                by_id[device_id]["tags"].append(tag)
+        return devices
+
+    def get(self, name):
+        with self.lock:
+            return self._select("WHERE name = ?", (name,)).get(name)
+
+    def get_many(self, names):
+        names = list(names)
+        devices = {}
+        with self.lock:
+            # Stay well below SQLite's limit on query parameters
+            for start in range(0, len(names), ITER_CHUNK_SIZE):
+                chunk = names[start:start + ITER_CHUNK_SIZE]
+                devices.update(self._select(f"WHERE name IN ({', '.join('?' for _ in chunk)})", chunk))
+        return devices
+
+    def items(self):
+        with self.lock:
+            return list(self._select().items())
+
+    def names(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT name FROM devices ORDER BY id")]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+    def _upsert(self, name, device):
+        columns = ", ".join(DEVICE_FIELDS)
+        placeholders = ", ".join("?" for _ in DEVICE_FIELDS)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in DEVICE_FIELDS)
+        self.conn.execute(
+            f"INSERT INTO devices (name, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT (name) DO UPDATE SET {updates}",
+            (name, *(device.get(field) for field in DEVICE_FIELDS))
+        )
+        device_id = self.conn.execute("SELECT id FROM devices WHERE name = ?", (name,)).fetchone()[0]
+        self.conn.execute("DELETE FROM device_tags WHERE device_id = ?", (device_id,))
+        self.conn.executemany(
+            "INSERT INTO device_tags (device_id, position, tag) VALUES (?, ?, ?)",
+            [(device_id, position, tag) for position, tag in enumerate(device.get("tags") or [])]
+        )
+
+    def _delete(self, name):
+        row = self.conn.execute("SELECT id FROM devices WHERE name = ?", (name,)).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM device_tags WHERE device_id = ?", row)
+            self.conn.execute("DELETE FROM devices WHERE id = ?", row)
+
+    def put(self, name, device):
+        with self.lock, self.conn:
+            self._upsert(name, device)
+
+    def put_many(self, devices):
+        with self.lock, self.conn:
+            for name, device in devices.items():
+                self._upsert(name, device)
+
+    def delete(self, name):
+        with self.lock, self.conn:
+            self._delete(name)
+
+    def replace(self, inventory):
+        """Applies the new inventory in one transaction; devices keep their position."""
+        with self.lock, self.conn:
+            for (name,) in self.conn.execute("SELECT name FROM devices").fetchall():
+                if name not in inventory:
+                    self._delete(name)
+            for name, device in inventory.items():
+                self._upsert(name, device)
+
+    def find(self, tag=None, **filters):
+        _check_filters(filters)
+        clauses, params = [], []
+        for field, value in filters.items():
+            if value is None:
+                clauses.append(f"{field} IS NULL")
+            else:
+                clauses.append(f"{field} = ?")
+                params.append(value)
+        if tag is not None:
+            clauses.append("id IN (SELECT device_id FROM device_tags WHERE tag = ?)")
+            params.append(tag)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            return [row[0] for row in self.conn.execute(f"SELECT name FROM devices {where} ORDER BY id", params)]
+
+    def tag_members(self, tag):
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT device_id FROM device_tags WHERE tag = ?", (tag,))}
+
+    def all_members(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT id FROM devices")}
+
+    def names_for(self, keys):
+        ids = sorted(keys)
+        names = []
+        with self.lock:
+            for start in range(0, len(ids), ITER_CHUNK_SIZE):
+                chunk = ids[start:start + ITER_CHUNK_SIZE]
+                names.extend(row[0] for row in self.conn.execute(
+                    f"SELECT name FROM devices WHERE id IN ({', '.join('?' for _ in chunk)}) ORDER BY id", chunk
+                ))
+        return names
+
+    def tag_counts(self):
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT tag, COUNT(DISTINCT device_id) FROM device_tags GROUP BY tag ORDER BY tag"
+            ).fetchall())
+
+    def view(self):
+        return _SqliteView(self)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def migrate_json_inventory(store, json_file):
+    """
+    Copies the devices of an inventory.json file into store in one go.
+    Returns the number of devices copied.
+    """
+    if not os.path.exists(json_file):
+        return 0
+    try:
+        with open(json_file, 'r') as f:
+            inventory = json.load(f)
+    except json.JSONDecodeError as e:
+        raise Exception(f"Cannot migrate {json_file}: {e}")
+    if inventory:
+        store.replace(inventory)
+        print(f"Migrated {len(inventory)} device(s) from {json_file} to {getattr(store, 'path', 'the inventory store')}")
+    return len(inventory)
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = int(os.environ.get("SESSION_POOL_MAX_SIZE", "100"))
+DEFAULT_IDLE_TTL = float(os.environ.get("SESSION_POOL_IDLE_TTL", "300"))
+
+class SessionPool:
+    """
+    Keeps authenticated DeviceConnections warm between batches, keyed by inventory name.
+    Idle sessions expire after idle_ttl seconds and the least recently used session
+    is evicted once max_size is reached. A session is health-checked before reuse.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, idle_ttl=DEFAULT_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        # name -> (signature, DeviceConnection, last_used); oldest first
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "unhealthy": 0}
+        self._reaper = None
+
+    def acquire(self, name, signature, connect):
+        """
+        Returns a connected DeviceConnection for the device, reusing a pooled one if possible.
+        The caller has exclusive use until it calls release() or discard().
+
+        Args:
+            name (str): Inventory name of the device.
+            signature (tuple): Connection parameters; a pooled session is only reused if they match.
+            connect (callable): Creates a new connected DeviceConnection on a miss.
+        """
+        stale = self._sweep()
+        with self.lock:
+            entry = self.sessions.pop(name, None)
+        if entry:
+            pooled_signature, connection, _ = entry
+            if pooled_signature != signature:
+                stale.append(connection)
+            elif not connection.is_alive():
+                with self.lock:
+                    self.stats["unhealthy"] += 1
+                stale.append(connection)
+            else:
+                with self.lock:
+                    self.stats["hits"] += 1
+                self._close(stale)
+                return connection
+
+        self._close(stale)
+        with self.lock:
+            self.stats["misses"] += 1
+        return connect()
+
+    def release(self, name, signature, connection):
+        """Returns a healthy session to the pool for later reuse."""
+        stale = []
+        with self.lock:
+            previous = self.sessions.pop(name, None)
+            if previous:
+                stale.append(previous[1])
+            self.sessions[name] = (signature, connection, time.monotonic())
+            while len(self.sessions) > self.max_size:
+                _, (_, evicted, _) = self.sessions.popitem(last=False)
+                self.stats["evictions"] += 1
+                stale.append(evicted)
+        self._close(stale)
+        self._start_reaper()
+
+    def discard(self, connection):
+        """Closes a session that must not be reused (e.g. after an error)."""
+        self._close([connection])
+
+    def close_all(self):
+        with self.lock:
+            stale = [entry[1] for entry in self.sessions.values()]
+            self.sessions.clear()
+        self._close(stale)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self.sessions)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["max_size"] = self.max_size
+        stats["idle_ttl"] = self.idle_ttl
+        return stats
+
+    def _sweep(self):
+        """Removes sessions idle for longer than idle_ttl and returns them for closing."""
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            while self.sessions:
+                name, (_, connection, last_used) = next(iter(self.sessions.items()))
+                if now - last_used < self.idle_ttl:
+                    break
+                del self.sessions[name]
+                self.stats["expired"] += 1
+                expired.append(connection)
+        return expired
+
+    def _close(self, connections):
+        for connection in connections:
+            try:
+                connection.disconnect()
+            except Exception:
+                pass
+
+    def _start_reaper(self):
+        """Starts a background thread that closes idle sessions between batches."""
+        with self.lock:
+            if self._reaper and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="session-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_ttl / 4))
+            self._close(self._sweep())
+            with self.lock:
+                if not self.sessions:
+                    self._reaper = None
+                    return
+
+# Process-wide pool shared by all batch paths
+session_pool = SessionPool()
@@ -102,30 +102,158 @@ class SSHTunnelManager:
             return self.tunnel1.is_active
         return False
 
+import os
+import threading
 import paramiko
 
+# Adaptive channel-open limiter defaults (per gateway session)
+CHANNEL_LIMIT_INITIAL = int(os.environ.get("GATEWAY_CHANNEL_LIMIT_INITIAL", "4"))
+CHANNEL_LIMIT_MAX = int(os.environ.get("GATEWAY_CHANNEL_LIMIT_MAX", "64"))
+CHANNEL_OPEN_SLOW_SECONDS = float(os.environ.get("GATEWAY_CHANNEL_OPEN_SLOW_SECONDS", "5"))
+CHANNEL_QUEUE_TIMEOUT = float(os.environ.get("GATEWAY_CHANNEL_QUEUE_TIMEOUT", "300"))
+# Seconds between checks of the stop event while queued for a channel slot
+STOP_POLL_INTERVAL = 0.25
+
+# Parallel authenticated transports per gateway session
+GATEWAY_TRANSPORTS = int(os.environ.get("GATEWAY_TRANSPORTS", "1"))
+
+# Seconds an unused per-chain gateway session stays open
+GATEWAY_IDLE_TIMEOUT = float(os.environ.get("GATEWAY_IDLE_TIMEOUT", "300"))
+
+# Channel open failures that mean "bastion is overloaded", not "device unreachable"
+THROTTLE_CODES = (
+    paramiko.common.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED,
+    paramiko.common.OPEN_FAILED_RESOURCE_SHORTAGE,
+)
+
+# Process-wide channel open outcomes across all gateway sessions
+channel_stats = {"success": 0, "rejected": 0, "failed": 0}
+_channel_stats_lock = threading.Lock()
+
+def _count_channel_open(outcome):
+    with _channel_stats_lock:
+        channel_stats[outcome] += 1
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent channel opens through a gateway.
+    The limit grows by one per window of successful opens and is halved
+    whenever the bastion rejects an open or an open is slow.
+    """
+    def __init__(self, initial=CHANNEL_LIMIT_INITIAL, minimum=1, maximum=CHANNEL_LIMIT_MAX,
+                 slow_threshold=CHANNEL_OPEN_SLOW_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_threshold = slow_threshold
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"successes": 0, "rejections": 0, "slow": 0}
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None, stop=None):
+        """
+        Waits for a free slot. Returns False if none became free within timeout,
+        or as soon as the stop event (threading.Event) is set.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    if stop is not None and stop.is_set():
+                        return False
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    if stop is not None:
+                        # A Condition cannot wait on the event too, so look at it regularly
+                        remaining = STOP_POLL_INTERVAL if remaining is None else min(remaining, STOP_POLL_INTERVAL)
+                    self.condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, duration=None, rejected=False):
+        """
+        Frees a slot and adapts the limit.
+
+        Args:
+            duration (float): Time the open took; None when the open failed for other reasons.
+            rejected (bool): True if the bastion refused the open.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if rejected:
+                self.stats["rejections"] += 1
+                self.limit = max(self.minimum, self.limit / 2)
+            elif duration is not None and duration > self.slow_threshold:
+                self.stats["slow"] += 1
+                self.limit = max(self.minimum, self.limit / 2)
+            elif duration is not None:
+                self.stats["successes"] += 1
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(
+                self.stats,
+                limit=int(self.limit),
+                in_flight=self.in_flight,
+                waiting=self.waiting,
+                maximum=self.maximum
+            )
+
 class GatewaySession:
     """
     Manages a persistent connection to a Gateway (Jump Host) using Paramiko.
-    Allows multiplexing multiple device connections through a single transport.
+    Allows multiplexing multiple device connections over one or more parallel
+    transports to the same jump host chain; new channels go to the least-loaded one.
     """
     def __init__(self):
         self.client = None
         self.transport = None
         self.gateway_host = None
+        self.limiter = AdaptiveLimiter()
+        # One entry per parallel transport: {"clients", "transport", "channels"}
+        self.links = []
+        self.lock = threading.Lock()
 
-    def connect(self, host, port, username, password, jumphost2_config=None):
+    def connect(self, host, port, username, password, jumphost2_config=None, transports=GATEWAY_TRANSPORTS):
         """
         Establishes the connection to the Gateway.
         If jumphost2_config is provided, it chains the connection: Local -> JH1 -> JH2.
+        With transports > 1, that many independent authenticated connections are
+        opened to the same chain so device traffic is spread over several TCP streams.
         """
+        try:
+            for index in range(max(1, int(transports))):
+                clients, transport = self._connect_chain(host, port, username, password, jumphost2_config)
+                self.links.append({"clients": clients, "transport": transport, "channels": []})
+                print(f"Gateway transport {index + 1}/{transports} established: {self.gateway_host}")
+
+            # First link is kept as the primary client/transport for existing callers
+            self.client = self.links[0]["clients"][0]
+            self.transport = self.links[0]["transport"]
+            return True
+        except Exception as e:
+            print(f"Gateway connection failed: {e}")
+            self.close()
+            raise e
+
+    def _connect_chain(self, host, port, username, password, jumphost2_config=None):
+        """Opens one authenticated transport through the jump host chain."""
+        clients = []
         try:
             # 1. Connect to First Jump Host
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            clients.append(client)
             
             print(f"Connecting to Gateway 1: {host}:{port}...")
-            self.client.connect(
+            client.connect(
                 hostname=host,
                 port=int(port),
                 username=username,
@@ -137,8 +265,8 @@ class GatewaySession:
                 auth_timeout=30
             )
             
-            self.transport = self.client.get_transport()
-            self.transport.set_keepalive(10)
+            transport = client.get_transport()
+            transport.set_keepalive(10)
             self.gateway_host = host
             print(f"Gateway 1 connection established: {host}")
 
@@ -152,17 +280,18 @@ class GatewaySession:
                 print(f"Chaining to Gateway 2: {jh2_host}:{jh2_port}...")
                 
                 # Open a channel from JH1 to JH2
-                jh2_channel = self.transport.open_channel(
+                jh2_channel = transport.open_channel(
                     "direct-tcpip",
                     (jh2_host, jh2_port),
                     ("127.0.0.1", 0)
                 )
                 
                 # Create a new SSHClient for JH2 using the channel as the socket
-                self.client2 = paramiko.SSHClient()
-                self.client2.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                client2 = paramiko.SSHClient()
+                client2.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                clients.append(client2)
                 
-                self.client2.connect(
+                client2.connect(
                     hostname=jh2_host, # Hostname is needed for host key verification (even if skipped)
                     username=jh2_user,
                     password=jh2_pass,
@@ -176,40 +305,326 @@ class GatewaySession:
                 
                 # Update transport to point to JH2's transport
                 # Now, open_channel calls will go through JH2
-                self.transport = self.client2.get_transport()
-                self.transport.set_keepalive(10)
+                transport = client2.get_transport()
+                transport.set_keepalive(10)
                 self.gateway_host = f"{host} -> {jh2_host}"
                 print(f"Gateway 2 connection established: {jh2_host}")
 
-            return True
-        except Exception as e:
-            print(f"Gateway connection failed: {e}")
-            self.close()
-            raise e
+            return clients, transport
+        except Exception:
+            for client in reversed(clients):
+                client.close()
+            raise
 
-    def open_channel(self, target_host, target_port):
+    def _pick_link(self):
+        """Returns the active link with the fewest open channels."""
+        with self.lock:
+            best = None
+            for link in self.links:
+                if not link["transport"].is_active():
+                    continue
+                link["channels"] = [c for c in link["channels"] if not c.closed]
+                if best is None or len(link["channels"]) < len(best["channels"]):
+                    best = link
+            return best
+
+    def open_channel(self, target_host, target_port, timeout=None, stop=None):
         """
         Opens a direct-tcpip channel to the target device through the gateway.
+        Opens are paced by the adaptive limiter: when the bastion rejects an open,
+        the device waits for a free slot and retries instead of failing.
+        timeout bounds the whole wait (queueing and opening) in seconds.
+        stop (threading.Event) ends the wait early, e.g. when the batch is cancelled.
         Returns a socket-like object.
         """
-        if not self.is_active():
-            raise Exception("Gateway is not connected.")
-            
-        print(f"Opening channel via {self.gateway_host} -> {target_host}:{target_port}")
-        # direct-tcpip channel behaves like a socket
-        channel = self.transport.open_channel(
-            "direct-tcpip",
-            (target_host, int(target_port)),
-            ("127.0.0.1", 0) # Source address (local)
-        )
-        return channel
+        deadline = time.monotonic() + (timeout or CHANNEL_QUEUE_TIMEOUT)
+        backoff = 0.5
+        while True:
+            if not self.is_active():
+                raise Exception("Gateway is not connected.")
+            if stop is not None and stop.is_set():
+                raise Exception(f"Stopped waiting for a gateway channel to {target_host}:{target_port}")
+            if not self.limiter.acquire(timeout=max(0, deadline - time.monotonic()), stop=stop):
+                if stop is not None and stop.is_set():
+                    raise Exception(f"Stopped waiting for a gateway channel to {target_host}:{target_port}")
+                raise Exception(f"Timed out waiting for a gateway channel slot to {target_host}:{target_port}")
+
+            link = self._pick_link()
+            if link is None:
+                self.limiter.release()
+                raise Exception("Gateway is not connected.")
+
+            print(f"Opening channel via {self.gateway_host} -> {target_host}:{target_port}")
+            start = time.monotonic()
+            try:
+                # direct-tcpip channel behaves like a socket
+                channel = link["transport"].open_channel(
+                    "direct-tcpip",
+                    (target_host, int(target_port)),
+                    ("127.0.0.1", 0), # Source address (local)
+                    timeout=max(1, deadline - time.monotonic()) if timeout else None
+                )
+            except paramiko.ChannelException as e:
+                throttled = e.code in THROTTLE_CODES
+                self.limiter.release(rejected=throttled)
+                _count_channel_open("rejected" if throttled else "failed")
+                if not throttled or time.monotonic() + backoff > deadline:
+                    raise
+                print(f"Gateway rejected channel to {target_host} ({e.text}), retrying in {backoff:.1f}s")
+                if stop is not None:
+                    if stop.wait(backoff):
+                        raise Exception(f"Stopped waiting for a gateway channel to {target_host}:{target_port}")
+                else:
+                    time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+                continue
+            except Exception:
+                self.limiter.release()
+                _count_channel_open("failed")
+                raise
+
+            self.limiter.release(duration=time.monotonic() - start)
+            _count_channel_open("success")
+            with self.lock:
+                link["channels"].append(channel)
+            return channel
+
+    def get_transport_stats(self):
+        """Returns the number of open channels per transport."""
+        with self.lock:
+            return [
+                {
+                    "active": link["transport"].is_active(),
+                    "channels": sum(1 for c in link["channels"] if not c.closed)
+                }
+                for link in self.links
+            ]
 
     def is_active(self):
-        return self.transport and self.transport.is_active()
+        return any(link["transport"].is_active() for link in self.links)
 
     def close(self):
-        if self.client:
-            self.client.close()
+        for link in self.links:
+            for client in reversed(link["clients"]):
+                try:
+                    client.close()
+                except Exception:
+                    pass
+        self.links = []
         self.client = None
         self.transport = None
         self.gateway_host = None
+
+class GatewayRegistry:
+    """
+    Shares one GatewaySession per jump host chain (jumphost1, jumphost2).
+    Sessions are created lazily the first time a device needs the chain and are
+    reference-counted by the devices using them; a chain nobody has used for
+    idle_timeout seconds is closed, unless it was registered manually.
+    """
+    # Seconds a failed chain login is remembered, so a batch does not retry it per device
+    FAILURE_TTL = 30
+
+    def __init__(self, transports=GATEWAY_TRANSPORTS, idle_timeout=GATEWAY_IDLE_TIMEOUT):
+        self.transports = transports
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.refs = {}
+        self.last_used = {}
+        self.pinned = set()
+        self.failures = {}
+        self.chain_locks = {}
+        self.lock = threading.Lock()
+        self.stats = {"logins": 0, "reuses": 0, "idle_closes": 0}
+        self._reaper = None
+
+    def get(self, jumphost1, jumphost2=None):
+        """Returns the active session for the chain, or None."""
+        with self.lock:
+            session = self.sessions.get((jumphost1, jumphost2 or None))
+        if session and session.is_active():
+            return session
+        return None
+
+    def register(self, jumphost1, jumphost2, session):
+        """
+        Stores an already connected session for the chain, closing the one it replaces.
+        Registered sessions are never closed for being idle.
+        """
+        key = (jumphost1, jumphost2 or None)
+        with self.lock:
+            previous = self.sessions.get(key)
+            self.sessions[key] = session
+            self.pinned.add(key)
+            self.last_used[key] = time.monotonic()
+            self.failures.pop(key, None)
+        if previous and previous is not session:
+            previous.close()
+
+    def get_or_connect(self, data_manager, jumphost1, jumphost2=None):
+        """
+        Returns the session for the chain, connecting it on first use.
+        Concurrent callers for the same chain wait for a single login.
+        """
+        key = (jumphost1, jumphost2 or None)
+        with self.lock:
+            chain_lock = self.chain_locks.setdefault(key, threading.Lock())
+
+        with chain_lock:
+            session = self.get(*key)
+            if session:
+                with self.lock:
+                    self.stats["reuses"] += 1
+                return session
+
+            with self.lock:
+                failure = self.failures.get(key)
+            if failure and time.monotonic() - failure[0] < self.FAILURE_TTL:
+                raise Exception(f"Gateway {' -> '.join(p for p in key if p)} unavailable: {failure[1]}")
+
+            jh1 = data_manager.get_jumphost(jumphost1)
+            if not jh1:
+                raise Exception(f"Jump host profile '{jumphost1}' not found.")
+            jh2 = None
+            if jumphost2:
+                jh2 = data_manager.get_jumphost(jumphost2)
+                if not jh2:
+                    raise Exception(f"Jump host profile '{jumphost2}' not found.")
+
+            session = GatewaySession()
+            try:
+                session.connect(
+                    jh1['host'],
+                    jh1['port'],
+                    jh1['username'],
+                    jh1['password'],
+                    jumphost2_config=jh2,
+                    transports=self.transports
+                )
+            except Exception as e:
+                with self.lock:
+                    self.failures[key] = (time.monotonic(), str(e))
+                raise
+
+            with self.lock:
+                previous = self.sessions.get(key)
+                self.sessions[key] = session
+                self.pinned.discard(key)
+                self.last_used[key] = time.monotonic()
+                self.failures.pop(key, None)
+                self.stats["logins"] += 1
+            if previous:
+                previous.close()
+            return session
+
+    def acquire(self, data_manager, jumphost1, jumphost2=None):
+        """
+        Like get_or_connect, but holds a reference on the chain so it is not
+        closed while in use. Every acquire must be paired with release().
+        """
+        key = (jumphost1, jumphost2 or None)
+        with self.lock:
+            # Count the reference before connecting so the reaper leaves the chain alone
+            self.refs[key] = self.refs.get(key, 0) + 1
+        try:
+            return self.get_or_connect(data_manager, jumphost1, jumphost2)
+        except Exception:
+            self.release(jumphost1, jumphost2)
+            raise
+
+    def release(self, jumphost1, jumphost2=None):
+        key = (jumphost1, jumphost2 or None)
+        with self.lock:
+            self.refs[key] = max(0, self.refs.get(key, 0) - 1)
+            self.last_used[key] = time.monotonic()
+        self._start_reaper()
+
+    def close_idle(self):
+        """Closes unpinned chains without references that were idle for idle_timeout."""
+        now = time.monotonic()
+        idle = []
+        with self.lock:
+            for key, session in list(self.sessions.items()):
+                if key in self.pinned or self.refs.get(key, 0):
+                    continue
+                if now - self.last_used.get(key, now) >= self.idle_timeout:
+                    del self.sessions[key]
+                    self.stats["idle_closes"] += 1
+                    idle.append(session)
+        for session in idle:
+            session.close()
+        return len(idle)
+
+    def close(self, jumphost1, jumphost2=None):
+        key = (jumphost1, jumphost2 or None)
+        with self.lock:
+            session = self.sessions.pop(key, None)
+            self.pinned.discard(key)
+        if session:
+            session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+            self.pinned.clear()
+            self.failures.clear()
+        for session in sessions:
+            session.close()
+
+    def list_chains(self):
+        now = time.monotonic()
+        with self.lock:
+            items = [
+                (key, session, self.refs.get(key, 0), now - self.last_used.get(key, now), key in self.pinned)
+                for key, session in self.sessions.items()
+            ]
+        return [
+            {
+                "jumphost1": jumphost1,
+                "jumphost2": jumphost2,
+                "active": bool(session.is_active()),
+                "gateway_host": session.gateway_host,
+                "refs": refs,
+                "idle_seconds": round(idle, 1),
+                "pinned": pinned
+            }
+            for (jumphost1, jumphost2), session, refs, idle, pinned in items
+        ]
+
+    def active_channels(self):
+        """Returns the number of open device channels over all chains."""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return sum(t["channels"] for session in sessions for t in session.get_transport_stats())
+
+    def get_stats(self):
+        """Returns login/reuse counters for the chain cache."""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["chains"] = len(self.sessions)
+            stats["refs"] = sum(self.refs.values())
+        lookups = stats["logins"] + stats["reuses"]
+        stats["reuse_rate"] = round(stats["reuses"] / lookups, 3) if lookups else 0.0
+        stats["idle_timeout"] = self.idle_timeout
+        return stats
+
+    def _start_reaper(self):
+        """Starts a background thread that closes idle chains."""
+        with self.lock:
+            if self._reaper and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="gateway-registry-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 4))
+            self.close_idle()
+            with self.lock:
+                if all(key in self.pinned for key in self.sessions):
+                    self._reaper = None
+                    return
+
+# Process-wide registry shared by all batch paths
+gateway_registry = GatewayRegistry()